@@ -5,20 +5,49 @@
 # PARAM
 #---------------------------------------------------------------------
 
-# database file
-BASE = "test"
-PATH = "."
-SDBFILE = "{0}/2do_{1}.db".format(PATH, BASE)
- 
-# mode debug
-DEBUG = False
+# the database, the write-behind batches, the snapshot, the shared mode
+# and the profiling are set in todo_core.py
+
+# write-behind: delay (ms) before the queued changes are committed, wait
+# (ms) of a commit on a locked database before it is retried later
+FLUSH_DELAY = 500
+FLUSH_TIMEOUT = 50
+
+# virtual list: only the visible rows (plus OVERSCAN above and below)
+# are rendered in the tasks listbox
+VIRTUAL = True
+OVERSCAN = 50
+
+# search as you type: delay (ms) after the last key, result polling (ms)
+SEARCH_DELAY = 250
+SEARCH_POLL = 30
+
+# console: open the database read-only by default
+CONSOLE_READONLY = False
+
+# trash: archived tasks loaded by page, the next page is loaded when
+# the list is scrolled near its end (milestone order only)
+ARCHIVES_PAGE = 500
+
+# shared database: polling (ms) of the changes committed by the other
+# instances
+SHARED_POLL = 2000
+
+# profiling: refresh (ms) of the rolling summary in the status bar, the
+# profile is saved on quit
+PROFILE_REFRESH = 1000
 
 #---------------------------------------------------------------------
 # PROGRAM
 #---------------------------------------------------------------------
 
-PROGRAM = "2do {}".format(BASE)
-VERSION = "v2.3"
+# the core : database, workers, command line, PROGRAM and VERSION
+from todo_core import *
+
+if __name__ == '__main__' and len(argv) > 1:
+    # command line (see todo_core.py) : exit before Tkinter is imported
+    raise SystemExit(cli_main(argv[1:]))
+
 DOCHELP = """
 {0} {1}
 --
@@ -44,6 +73,10 @@ Keyboard shortcuts on main window:
  <F11> Open console
  <F12> View trash
  <ESC> Help
+--
+Search box:
+ words        full-text search (prefixes, all words)
+ %pattern%    SQL LIKE pattern
 
 """.format(PROGRAM, VERSION)
 
@@ -52,69 +85,51 @@ Keyboard shortcuts on main window:
 # SOURCE CODE
 #---------------------------------------------------------------------
 
-from sqlite3 import connect
-from sqlite3 import Error as SqlError
 from os import name as uname
-from os.path import isfile
-from os.path import expanduser
-from datetime import datetime
-from tkinter import *
-from tkinter.scrolledtext import ScrolledText
-from tkinter.simpledialog import askstring
-from tkinter.messagebox import showinfo
-from tkinter.messagebox import showerror
-from tkinter.messagebox import askyesno
-from tkinter.filedialog import asksaveasfilename
-from tkinter.filedialog import askopenfilename
-
-
-def debug(msgs):
-    if DEBUG:
-        print("[DEBUG]", msgs)
+from queue import Empty
+from difflib import SequenceMatcher
 
 def start_to_do_app():
     return(to_do_app(PROGRAM, VERSION, DOCHELP))
 
-def today():
-    now = datetime.now()
-    return(now.strftime("%d/%m/%Y"))
-
-def is_urgent(date):
-    if not (len(date) == 10 and date[2] == '/' and date[5] == '/'):
-        return(False)
-    try:
-        d = int(date[0:2])
-        m = int(date[3:5])
-        y = int(date[6:10])
-    except ValueError:
-        return(False)
-    else:
-        t = today()
-        dt = int(t[0:2])
-        mt = int(t[3:5])
-        yt = int(t[6:10])
-        if y < yt or (y == yt and m < mt) or (y == yt and m == mt and d <= dt):
-            return(True)
-        else:
-            return(False)
-    
 
-class to_do_app(object):
+#---------------------------------------------------------------------
+# USER INTERFACE
+#---------------------------------------------------------------------
+
+try:
+    from tkinter import *
+    from tkinter.scrolledtext import ScrolledText
+    from tkinter.simpledialog import askstring
+    from tkinter.messagebox import showinfo
+    from tkinter.messagebox import showerror
+    from tkinter.messagebox import askyesno
+    from tkinter.filedialog import asksaveasfilename
+    from tkinter.filedialog import askopenfilename
+except ImportError:
+    # headless system : only to_do_core and the command line are usable
+    pass
+
+
+def listbox_itemconfig_many(lb, indexes, fg, bg):
+    "Set the colors of several rows of a Tk listbox in one Tcl call"
+    script = "{0} itemconfigure $i -foreground {{{1}}} -background {{{2}}}".format(lb, fg, bg)
+    lb.tk.call("foreach", "i", tuple(indexes), script)
+
+
+class to_do_app(to_do_core):
     "Class for 2do application"
 
     def __init__(self, program, version, dochelp):
         "Initialize the class"
         # open/create the database
-        self.db = self.db_open_connection()
+        self.flush_job = None
+        to_do_core.__init__(self)
         # init variables
         self.program = program
         self.version = version
         self.dochelp = dochelp
-        self.task = None
-        self.tasks = dict()
-        self.sksat = dict()
-        self.archives = None
-        self.filter = False
+        self.ui_init_variables()
         if self.db:
             # launch app
             self.ui = self.ui_draw_window()
@@ -130,152 +145,72 @@ class to_do_app(object):
             self.ui_display_log(SDBFILE)
             self.ui.lb.selection_set(END)
             self.ui.lb.see(END)
+            if SHARED:
+                self.data_version = self.db_get_data_version()
+                self.ui.after(SHARED_POLL, self.ui_poll_changes)
             # loop
             self.ui.mainloop()
             # close database
-            self.db.close()
+            self.db_close()
         else:
             print("Database error !")
 
-
-    ### DATABASE MANAGEMENT FUNCTIONS ###############################
-
-    def db_is_new(self, dbfile):
-        "Return True if the database doesn't exist"
-        if isfile(dbfile):
-            return(False)
-        else:
-            return(True)
-
-    def db_open_connection(self):
-        "Open the database if exists, else create a new database"
-        path = expanduser(SDBFILE)
-        debug([path])
-        new = self.db_is_new(path)
-        db = connect(path)
-        if not new:
-            return(db)
-        elif new and self.db_create_tables(db):
-            return(db)
-        else:
-            return(None)
-
-    def db_create_tables(self, db):
-        "Create the database's tables"
-        sql = "CREATE TABLE tasks (task TEXT, milestone TEXT, active INT, done INT, urgent INT, team TEXT, date TEXT, updated TEXT);"
-        debug([sql])
-        db.execute(sql)
-        db.commit()
-        sql = "CREATE TABLE milestones (lb TEXT PRIMARY KEY NOT NULL, fg TEXT DEFAULT ('#000000'), bg TEXT DEFAULT ('#FFFFFF'), active BOOLEAN DEFAULT (1));"
-        debug([sql])
-        db.execute(sql)
-        db.commit()
-        sql = "INSERT INTO milestones(lb) VALUES('milestone');"
-        debug([sql])
-        db.execute(sql)
-        db.commit()
-        sql = "CREATE TABLE teams (lb TEXT PRIMARY KEY NOT NULL, fg TEXT DEFAULT ('#000000'), bg TEXT DEFAULT ('#FFFFFF'), active BOOLEAN DEFAULT (1));"
-        debug([sql])
-        db.execute(sql)
-        db.commit()
-        for team in [("ANA","#000000","#F68383"),("CHF","#000000","#81DAF5"),("Q/R","#DF731B","#FFFFFF"),
-                  ("DEV","#000000","#D083F6"),("COR","#000000","#86F683"),("QAL","#000000","#F6B783"),
-                  ("RE7","#088A08","#FFFFFF"),("ARB","#1B7ADF","#FFFFFF"),("VAL","#A4A4A4","#FFFFFF"),
-                  ("N/A", "#000000","#FFFFFF")]:
-            sql = "INSERT INTO teams(lb, fg, bg) VALUES(?, ?, ?);"
-            db.execute(sql, team)
-        db.commit()
-        self.db = db
-        return(True)
-
-    def db_get_milestones(self):
-        "Get milestones"
-        sql = "SELECT lb, active FROM milestones WHERE active = 1 ORDER BY lb ;"
-        r = self.db.execute(sql)
-        return(r.fetchall())
-
-    def db_get_teams(self):
-        "Get teams"
-        sql = "SELECT lb, fg, bg, active FROM teams WHERE active = 1 ORDER BY lb;"
-        r = self.db.execute(sql)
-        return(r.fetchall())
-        
-    def db_create_task(self, task, team):
-        "Add the task in the database"
-        sql = "INSERT INTO tasks (task, milestone, team, active, done, urgent, updated) VALUES (?, '', ?, 1, 0, 0, ?);"
-        debug([sql, task, team, today()])
-        id = self.db.execute(sql, (task, team, today())).lastrowid
-        self.db.commit()
-        return(id)
-
-    def db_set_task_property(self, id, tag, value):
-        "Set task property"
-        update_date = False
-        if tag == "milestone":
-            sql = "UPDATE tasks SET milestone = ? WHERE rowid = ? ;"
-        elif tag == "team":
-            sql = "UPDATE tasks SET team = ? WHERE rowid = ? ;"
-            update_date = True
-        elif tag == "active":
-            sql = "UPDATE tasks SET active = ? WHERE rowid = ? ;"
-        elif tag == "done":
-            sql = "UPDATE tasks SET done = ? WHERE rowid = ? ;"
-            update_date = True
-        elif tag == "urgent":
-            sql = "UPDATE tasks SET urgent = ? WHERE rowid = ? ;"
-        elif tag == "task":
-            sql = "UPDATE tasks SET task = ? WHERE rowid = ? ;"
-        elif tag == "date":
-            sql = "UPDATE tasks SET date = ? WHERE rowid = ? ;"
-        else:
-            return(False)
-        debug([sql, value, id])
-        self.db.execute(sql, (value, id))
-        if update_date:
-            sql = "UPDATE tasks SET updated = ? WHERE rowid = ? ;"
-            debug([sql, today(), id])
-            self.db.execute(sql, (today(), id))
-        self.db.commit()
-        return(True)
-
-    def db_get_tasks_list(self, archives, mask="%"):
-        "Get the tasks list"
-        sql = "SELECT rowid, task, milestone, active, done, urgent, team, date, updated FROM tasks WHERE active = ? AND (task LIKE ? OR team LIKE ? OR milestone LIKE ? OR date LIKE ?) ORDER BY milestone, task, rowid ;"
-        if archives:
-            debug([sql, 0, mask, mask, mask])
-            r = self.db.execute(sql, (0, mask, mask, mask, mask))
-        else:
-            debug([sql, 1, mask, mask, mask])
-            r = self.db.execute(sql, (1, mask, mask, mask, mask))
-        return(r.fetchall())
-
-    def task_create_task_from_task(self, id):
-        "Create a task duplicating an existing task"
-        task = self.task_get_task_details(id)
-        sql = "INSERT INTO tasks (task, milestone, team, active, done, urgent, updated) VALUES (?, ?, ?, 1, 0, 0, ?);"
-        debug([sql, task['task'], task['milestone'], task['team']])
-        new = self.db.execute(sql, (task['task'], task['milestone'], task['team'], today())).lastrowid
-        self.db.commit()
-        return(new)
-
-    def task_get_task_details(self, id):
-        "Get task's details"
-        sql = "SELECT rowid, task, milestone, active, done, urgent, team, date, updated FROM tasks WHERE rowid = ? ;"
-        debug([sql, id])
-        r = self.db.execute(sql, (id, ))
-        t = dict()
-        for id, task, milestone, active, done, urgent, team, date, updated in r.fetchall():
-            debug([id, task, milestone, active, done, urgent, team, date, updated])
-            t['id'] = id
-            t['task'] = task
-            t['milestone'] = milestone
-            t['active'] = int(active)
-            t['done'] = int(done)
-            t['urgent'] = int(urgent)
-            t['team'] = team
-            t['date'] = date
-            t['updated'] = updated
-            return(t)
+    def ui_init_variables(self):
+        "Initialize the state of the window"
+        self.task = None
+        self.tasks = dict()
+        self.sksat = dict()
+        self.rows = []
+        self.view = None
+        self.order = "milestone"
+        self.archives = None
+        self.filter = False
+        self.export = None
+        self.search = None
+        self.search_seq = 0
+        self.search_job = None
+        self.search_polling = False
+        self.data_version = None
+        self.workspaces = [self.dbfile] + [f for f in map(expanduser, WORKSPACES) if f != self.dbfile]
+        self.styles = dict()
+        self.page_after = None
+        self.page_job = None
+        self.flush_locked = False
+
+    def clear_teams(self):
+        "Forget the teams param and the rows colors"
+        to_do_core.clear_teams(self)
+        self.styles.clear()
+
+
+    ### DATABASE MANAGEMENT FUNCTIONS ###############################
+
+    def db_schedule_flush(self):
+        "Commit the pending writes after FLUSH_DELAY"
+        if self.flush_job is None:
+            self.flush_job = self.ui.after(FLUSH_DELAY, self.db_flush)
+        self.ui_display_pending()
+
+    def db_flush(self):
+        "Commit the pending writes in one transaction (retried when the database is locked)"
+        if self.flush_job is not None:
+            self.ui.after_cancel(self.flush_job)
+            self.flush_job = None
+        if self.pending:
+            # a locked database fails at once instead of freezing the window
+            busy = self.db.execute("PRAGMA busy_timeout;").fetchone()[0]
+            self.db.execute("PRAGMA busy_timeout = {0};".format(FLUSH_TIMEOUT))
+            try:
+                to_do_core.db_flush(self)
+                self.flush_locked = False
+            except SqlError as e:
+                # locked by another connection : the writes stay pending
+                debug(["Commit failed, retrying", e])
+                self.flush_locked = True
+                self.flush_job = self.ui.after(FLUSH_DELAY, self.db_flush)
+            finally:
+                self.db.execute("PRAGMA busy_timeout = {0};".format(busy))
+            self.ui_display_pending()
 
 
     ### CALLBACKS ###################################################
@@ -283,27 +218,36 @@ class to_do_app(object):
     def cb_refresh(self, event=None):
         "Event Refresh - Reload"
         self.ui_display_log("Reloading data…")
+        self.clear_teams()
         total = self.ui_reload_tasks_list(self.archives)
         self.ui_display_log("{0} tasks displayed".format(total))
 
     def cb_open_console(self, event=None):
         "Event open console"
-        console(self.db, self.ui)
+        self.db_flush()
+        console(self.dbfile, self.ui)
 
     def cb_export_csv(self, event=None):
         "Event export as csv"
+        if self.export:
+            return
         self.ui_display_log("Exporting csv file…")
-        total = self.export_tasks_list(self.archives)
-        if total:
-            self.ui_display_log("{0} tasks exported".format(total))
-        else:
+        if not self.export_tasks_list(self.archives):
             self.ui_display_log("Cancelled.")
 
+    def cb_cancel_export(self, event=None):
+        "Event cancel the running export"
+        if self.export:
+            self.export.cancelled.set()
+
     def cb_import_csv(self, event=None):
-        "Event export as csv"
+        "Event import csv"
         self.ui_display_log("Importing csv file…")
-        total = self.import_tasks_list()
-        self.ui_display_log("{0} task(s) imported".format(total))
+        r = self.import_tasks_list()
+        if r:
+            self.ui_display_log("{0} task(s) imported, {1} line(s) rejected ({2:.0f} tasks/s)".format(*r))
+        else:
+            self.ui_display_log("Cancelled.")
 
     def cb_toggle_display(self, event=None):
         "Event toggle tasks/archive mode"
@@ -353,12 +297,11 @@ class to_do_app(object):
 
     def cb_duplicate_task(self, event=None):
         "Event duplicate task"
-        tasks = self.ui.lb.curselection()
+        ids = self.ui_get_selected_ids()
         self.ui.clipboard_clear()
-        for task in tasks:
-            id = self.tasks[str(task)]
-            new = self.task_create_task_from_task(id)
-            self.ui_display_log("Task {0} duplicated in {1}.".format(id, new))
+        if ids:
+            new = self.task_create_tasks_from_tasks(ids)
+            self.ui_display_log("{0} task(s) duplicated ({1}).".format(len(new), ", ".join(map(str, new))))
         self.ui_reload_tasks_list(self.archives)
 
     def cb_copy_task(self, event=None):
@@ -368,7 +311,7 @@ class to_do_app(object):
         for task in tasks:
             id = self.tasks[str(task)]
             old = self.task_get_task_details(id)
-            self.ui.clipboard_append(old['task'])
+            self.ui.clipboard_append(old.task)
             self.ui_display_log("Task {0} copied.".format(id))
 
     def cb_copy_notes(self, event=None):
@@ -378,8 +321,8 @@ class to_do_app(object):
         for task in tasks:
             id = self.tasks[str(task)]
             old = self.task_get_task_details(id)
-            if len(old['task']) > 5:
-                self.ui.clipboard_append(old['task'][0:5]+", ")
+            if len(old.task) > 5:
+                self.ui.clipboard_append(old.task[0:5]+", ")
             self.ui_display_log("Ctrl + v to paste in Notes…")
             
     def cb_edit_task(self, event=None):
@@ -424,117 +367,213 @@ class to_do_app(object):
 
     def cb_toggle_task_archive(self, event=None):
         "Event toggle archive flag"
-        ids = self.ui.lb.curselection()
-        for task in ids:
-            id = self.tasks[str(task)]
-            lb = self.task_get_task(id)
-            if self.task_is_archived(id) and \
-               askyesno("Archive ?", "Do yo want to archive this task ?\n\"{0}\"".format(lb)):
-                self.db_set_task_property(id, "active", 0)
-                self.ui_display_log("Task {0} archived !".format(id))
+        ids = self.ui_get_selected_ids()
+        if not ids:
+            return
+        if self.archives:
+            self.db_move_tasks(ids, 1)
+            self.ui_display_log("{0} task(s) un-archived !".format(len(ids)))
+        else:
+            if len(ids) == 1:
+                question = "Do yo want to archive this task ?\n\"{0}\"".format(self.task_get_task(ids[0]))
             else:
-                self.db_set_task_property(id, "active", 1)
-                self.ui_display_log("Task {0} un-archived !".format(id))
+                question = "Do yo want to archive these {0} tasks ?".format(len(ids))
+            if not askyesno("Archive ?", question):
+                return
+            self.db_move_tasks(ids, 0)
+            self.ui_display_log("{0} task(s) archived !".format(len(ids)))
         self.ui_reload_tasks_list(self.archives)
 
     def cb_toggle_task_done(self, event=None):
         "Event toggle done flag"
         if not self.archives:
-            ids = self.ui.lb.curselection()
-            for task in ids:
-                id = self.tasks[str(task)]
-                if self.task_is_done(id):
-                    self.db_set_task_property(id, "done", 0)
-                    self.ui_display_log("Task {0} un-done !".format(id))
-                else:
-                    self.db_set_task_property(id, "done", 1)
-                    self.ui_display_log("Task {0} done !".format(id))
-            self.ui_reload_tasks_list(self.archives, task=id)
+            ids = self.ui_get_selected_ids()
+            if ids:
+                self.db_toggle_tasks_flag(ids, "done")
+                self.ui_display_log("Status of {0} task(s) toggled !".format(len(ids)))
+                self.ui_reload_tasks_list(self.archives, task=ids[-1])
 
     def cb_toggle_task_urgent(self, event=None):
         "Event toggle urgent flag"
         if not self.archives:
-            ids = self.ui.lb.curselection()
-            for task in ids:
-                id = self.tasks[str(task)]
-                if self.task_is_urgent(id):
-                    self.db_set_task_property(id, "urgent", 0)
-                    self.ui_display_log("Task {0} is not urgent !".format(id))
-                else:
-                    self.db_set_task_property(id, "urgent", 1)
-                    self.ui_display_log("Task {0} is urgent !".format(id))
-            self.ui_reload_tasks_list(self.archives, task=id)
+            ids = self.ui_get_selected_ids()
+            if ids:
+                self.db_toggle_tasks_flag(ids, "urgent")
+                self.ui_display_log("Urgent flag of {0} task(s) toggled !".format(len(ids)))
+                self.ui_reload_tasks_list(self.archives, task=ids[-1])
 
     def cb_filter(self, event=None):
-        "Event search"
-        mask = self.mask.get()
-        if mask == "":
-            mask = "%"
-            self.mask.set(mask)
-        self.ui_reload_tasks_list(self.archives, END, None)
-        self.ui_display_log("Only tasks matching '{0}' are displayed !".format(mask))
+        "Event search (at once, by the search worker)"
+        if self.mask.get() == "":
+            self.mask.set("%")
+        if self.search_job is not None:
+            self.ui.after_cancel(self.search_job)
+        self.task_search()
+
+    def cb_live_filter(self, *args):
+        "Event search as you type (debounced), on the changes of the search box"
+        if self.search_job is not None:
+            self.ui.after_cancel(self.search_job)
+        self.search_job = self.ui.after(SEARCH_DELAY, self.task_search)
+
+    def cb_toggle_order(self, event=None):
+        "Event toggle milestone/due date order"
+        if self.order == "milestone":
+            self.order = "due"
+            self.ui.fb.ord.configure(text="Tri jalon")
+            self.ui_display_log("Tasks sorted by due date…")
+        else:
+            self.order = "milestone"
+            self.ui.fb.ord.configure(text="Tri date")
+            self.ui_display_log("Tasks sorted by milestone…")
+        self.ui_reload_tasks_list(self.archives)
 
     def cb_display_help(self, event=None):
         "Event display help"
         t = "{0} {1}".format(self.program, self.version)
         showinfo(t, self.dochelp)
 
+    def cb_switch_workspace(self, name):
+        "Event switch to another workspace"
+        dbfile = dict((workspace_name(f), f) for f in self.workspaces)[name]
+        self.db_flush()
+        if self.pending:
+            self.workspace.set(workspace_name(self.dbfile))
+            self.ui_display_log("Changes not saved yet (database locked), cannot switch !")
+            return
+        if self.search:
+            # the search worker reads the previous database
+            self.search.stop()
+            self.search = None
+        if not self.db_use_workspace(dbfile):
+            self.workspace.set(workspace_name(self.dbfile))
+            self.ui_display_log("Cannot open {0} !".format(dbfile))
+            return
+        if SHARED:
+            self.data_version = self.db_get_data_version()
+        self.workspace.set(name)
+        self.ui.title("{0} {1} - {2}".format(self.program, self.version, name))
+        self.cb_restart()
+        self.ui_display_log("Workspace {0}, {1} tasks displayed".format(name, len(self.rows)))
+
+    def cb_search_workspaces(self, event=None):
+        "Event search in all the workspaces"
+        mask = self.mask.get() or "%"
+        l = self.db_search_workspaces(self.workspaces, mask, bool(self.archives))
+        self.ui_draw_found_window(l, mask)
+        self.ui_display_log("{0} tasks matching '{1}' in {2} workspaces".format(len(l), mask, len(self.workspaces)))
+
+    def cb_open_found_task(self, rows, selection):
+        "Event open a task found in the workspaces"
+        if selection:
+            source, id = rows[selection[0]][:2]
+            if source != workspace_name(self.dbfile):
+                self.cb_switch_workspace(source)
+            self.ui_reload_tasks_list(self.archives, task=id)
+            self.ui.lift()
+
     def cb_display_task(self, event=None):
         "Event display task details"
         ids = self.ui.lb.curselection()
         for task in ids:
             id = self.tasks[str(task)]
             t = self.task_get_task_details(id)
-            text = t['task'] + "\n"
-            if t['urgent']:
+            text = t.task + "\n"
+            if t.urgent:
                 text += "/!\\ URGENT /!\\ \n"
-            text += "Date: " + t['date'] + "\n"
-            text += "Updated: " + t['updated'] + "\n"
-            text += "Team: " + t['team'] + "\n"
-            text += "Milestone: " + t['milestone'] + "\n"
-            if t['done']:
+            text += "Date: " + t.date + "\n"
+            text += "Updated: " + t.updated + "\n"
+            text += "Team: " + t.team + "\n"
+            text += "Milestone: " + t.milestone + "\n"
+            if t.done:
                 text += "This task is finished.\n"
-            if not t['active']:
+            if not t.active:
                 text += "This task is archived.\n"
             showinfo("Task n°{0}".format(id), text)
 
     def cb_restart(self, event=None):
+        "Event restart : read the teams and milestones again, redraw the tag toolbars and the list"
+        self.db_flush()
+        self.clear_teams()
+        self.repo.clear()
+        ui = self.ui
+        ui.tg1.destroy()
+        ui.tg2.destroy()
+        # the new toolbars go back above the filterbar
+        ui.tg1 = self.ui_draw_team_buttons(ui)
+        ui.tg1.pack(fill=X, before=ui.fb)
+        ui.tg2 = self.ui_draw_milestone_buttons(ui)
+        ui.tg2.pack(fill=X, before=ui.fb)
+        self.view = None
+        total = self.ui_reload_tasks_list(self.archives)
+        self.ui_display_log("Restarted, {0} tasks displayed".format(total))
+
+    def cb_save_profile(self, event=None):
+        "Event save the profile"
+        try:
+            prof.dump(PROFILE_FILE)
+            self.ui_display_log("Profile saved in {0}".format(PROFILE_FILE))
+        except OSError as e:
+            self.ui_display_log("Cannot save the profile : {0}".format(e))
+
+    def cb_quit(self, event=None):
+        "Event quit"
+        if self.search:
+            self.search.stop()
+        self.db_flush()
+        if prof.enabled:
+            self.cb_save_profile()
         self.ui.destroy()
-        start_to_do_app()
 
         
     ### FUNCTIONS ###################################################
 
-    def task_get_task(self, id):
-        "Get a task"
-        t = self.task_get_task_details(id)
-        return(t['task'])
-
-    def task_get_date(self, id):
-        "Get task's due date"
-        t = self.task_get_task_details(id)
-        return(t['date'])
-
-    def task_get_updated(self, id):
-        "Get task's update date"
-        t = self.task_get_task_details(id)
-        return(t['updated'])
-
-    def task_is_urgent(self, id):
-        "Get urgent flag for the task"
-        t = self.task_get_task_details(id)
-        return(t['urgent'])
-
-    def task_is_done(self, id):
-        "Get done flag for the task"
-        t = self.task_get_task_details(id)
-        return(t['done'])
-
-    def task_is_archived(self, id):
-        "Get the *active* flag for the task"
-        t = self.task_get_task_details(id)
-        return(t['active'])
-    
+    def task_search(self):
+        "Send the current search to the search worker"
+        self.search_job = None
+        mask = self.mask.get() or "%"
+        if SNAPSHOT and not self.archives:
+            # in memory : fast enough to answer at once
+            self.search_seq += 1
+            total = self.ui_reload_tasks_list(self.archives, END, None)
+            facets = self.snapshot.facets(self.snapshot.matched)
+            teams = ", ".join("{0} {1}".format(t, n) for t, n in facets["team"].most_common(3))
+            self.ui_display_log("{0} tasks matching '{1}' ({2} done, {3} urgent, {4})".format(total, mask, facets["done"], facets["urgent"], teams))
+            return
+        if self.search is None:
+            self.search = search_worker(self.dbfile)
+            self.search.start()
+        # the worker only sees the committed tasks
+        self.db_flush()
+        self.search_seq += 1
+        limit = self.ui_get_page_limit(self.archives, mask)
+        self.search.submit(self.search_seq, self.db_get_tasks_queries(self.archives, mask, self.order, limit=limit))
+        if not self.search_polling:
+            self.search_polling = True
+            self.ui.after(SEARCH_POLL, self.ui_poll_search)
+
+    def ui_poll_search(self):
+        "Display the result of the latest search when it is ready"
+        if self.search is None:
+            # stopped by a workspace switch
+            self.search_polling = False
+            return
+        try:
+            while True:
+                seq, l = self.search.results.get_nowait()
+                if seq != self.search_seq:
+                    # outdated or interrupted search
+                    continue
+                self.search_polling = False
+                if l is None:
+                    self.ui_display_log("Search failed !")
+                    return
+                total = self.ui_reload_tasks_list(self.archives, END, None, data=l)
+                self.ui_display_log("{0} tasks matching '{1}'".format(total, self.mask.get()))
+                return
+        except Empty:
+            self.ui.after(SEARCH_POLL, self.ui_poll_search)
+
     def task_create(self, task=None):
         "Create a new task"
         self.ui_display_log("Appending new task…")
@@ -550,85 +589,218 @@ class to_do_app(object):
 
     def task_set_property(self, tag, value, update_date=False):
         "Tag milestone/team"
-        ids = self.ui.lb.curselection()
-        for task in ids:
-            id = self.tasks[str(task)]
-            if self.db_set_task_property(id, tag, value):
-                self.ui_display_log("Task {0} tagged for {1} !".format(id, value))
-            else:
-                self.ui_display_log("Cannot tag {0} for {1} !".format(id, value))
-        self.ui_reload_tasks_list(self.archives, task=id)
+        ids = self.ui_get_selected_ids()
+        if not ids:
+            return
+        if self.db_set_tasks_property(ids, tag, value):
+            self.ui_display_log("{0} task(s) tagged for {1} !".format(len(ids), value))
+        else:
+            self.ui_display_log("Cannot tag the tasks for {0} !".format(value))
+        self.ui_reload_tasks_list(self.archives, task=ids[-1])
 
     def export_tasks_list(self, archives=False):
-        "Reload tasks/archives list"
+        "Export the tasks/archives list as CSV in background"
         fn = asksaveasfilename(title="Export as CSV…")
-        if fn:
-            f = open(fn, 'w')
-            l = self.db_get_tasks_list(archives, self.mask.get())
-            f.write("id;task;milestone;active;done;urgent;team;date;updated\n")
-            for id, task, milestone, active, done, urgent, team, date, updated in l:
-                c = "{};{};{};{};{};{};{};{};{}\n".format(id, task, milestone, active, done, urgent, team, date, updated)
-                f.write(c)
-            f.close()
-            return(len(l))
+        if not fn:
+            return(False)
+        # the export thread reads the database with its own connection
+        self.db_flush()
+        queries = self.db_get_tasks_queries(archives, self.mask.get(), self.order)
+        self.export = csv_export(self.dbfile, fn, queries)
+        self.export.start()
+        self.ui.fb.exp.configure(text="Annuler", command=self.cb_cancel_export)
+        # the displayed rows are the exported ones, unless the trash is loaded by pages
+        whole = self.page_after is None and self.view == (archives, self.mask.get(), self.order)
+        self.ui.after(200, self.ui_poll_export, len(self.rows) if whole else None)
+        return(True)
+
+    def ui_poll_export(self, total):
+        "Display the export progress until it is finished (total : None if unknown)"
+        export = self.export
+        rate = export.count / max(time() - export.started, 0.001)
+        if not export.done:
+            count = export.count if total is None else "{0}/{1}".format(export.count, total)
+            self.ui_display_log("Exporting csv file… {0} tasks ({1:.0f} tasks/s)".format(count, rate))
+            self.ui.after(200, self.ui_poll_export, total)
+            return
+        self.ui.fb.exp.configure(text="Exporter", command=self.cb_export_csv)
+        self.export = None
+        if export.error:
+            self.ui_display_log("Export failed : {0}".format(export.error))
+        elif export.cancelled.is_set():
+            self.ui_display_log("Export cancelled.")
         else:
-            return(0)    
+            self.ui_display_log("{0} tasks exported ({1:.0f} tasks/s)".format(export.count, rate))
 
     def import_tasks_list(self):
+        "Import a CSV file"
         fn = askopenfilename(title="Import CSV…")
-        c = 0
-        if fn:
-            f = open(fn, 'r')
-            for l in f:
-                l = l.replace('\n','')
-                ls = l.split(";")
-                if len(ls) != 8 or ls[0] == 'id':
-                    continue
-                id = self.db_create_task(ls[1], ls[6])
-                self.db_set_task_property(id, 'done', ls[4])
-                self.db_set_task_property(id, 'urgent', ls[5])
-                self.db_set_task_property(id, 'milestone', ls[2])
-                if ls[7] != 'None':
-                    self.db_set_task_property(id, 'date', ls[7])
-                c += 1
-            f.close()
-            if c:
-                self.ui_reload_tasks_list(self.archives)
-        return(c)
-
-    def get_teams(self):
-        "Get teams param"
-        l = self.db_get_teams()
-        t = {}
-        for lb, fg, bg, act in l:
-            t[lb] = (fg, bg)
-        return(t)
-        
-    def ui_reload_tasks_list(self, archives=False, selection=END, task=None):
-        "Reload tasks/archives list"
-        self.ui.lb.delete(0, END)
-        self.tasks = dict()
-        self.sksat = dict()
-        if archives:
-            self.ui_load_tasks_list(True)
-        else:
-            self.ui_load_tasks_list(False)
+        if not fn:
+            return(None)
+        start = time()
+        try:
+            with open(fn, 'r', newline='', encoding='utf-8') as f:
+                c, rejected = self.db_import_csv(f)
+        except (SqlError, OSError, ValueError) as e:
+            showerror("Import CSV…", "Cannot import {0} :\n{1}".format(fn, e))
+            return(None)
+        if c:
+            self.ui_reload_tasks_list(self.archives)
+        return(c, rejected, c / max(time() - start, 0.001))
+
+    def ui_reload_tasks_list(self, archives=False, selection="end", task=None, data=None):
+        "Reload tasks/archives list, updating only the rows which changed"
+        lb = self.ui.lb
+        view = (archives, self.mask.get(), self.order)
+        same = (view == self.view)
+        # remember what is displayed (top row, selected tasks)
+        top = self.tasks.get(str(lb.nearest(0))) if self.rows else None
+        selected = [self.tasks[str(i)] for i in lb.curselection()]
+        start = prof.start()
+        rows = self.ui_get_tasks_rows(archives, data)
+        prof.stop("query", start, len(rows))
+        start = prof.start()
+        self.ui_diff_tasks_list(rows)
+        self.ui_set_tasks_rows(rows)
+        prof.stop("reload", start, len(rows))
+        self.ui_display_counts()
         self.archives = archives
-        self.ui.lb.focus_set()
-        if task:
-            selection = self.sksat[task] 
+        self.view = view
+        lb.focus_set()
+        lb.selection_clear(0, END)
+        if task and task in self.sksat:
+            selection = self.sksat[task]
+        elif same and (selected or top):
+            # same view : keep the scroll position and the selection
+            if top in self.sksat:
+                lb.yview(self.sksat[top])
+            for id in selected:
+                if id in self.sksat:
+                    lb.selection_set(self.sksat[id])
+            return(len(self.tasks))
         elif len(selection) > 1 and selection != END:
             selection = selection[-1:]
-        self.ui.lb.selection_set(selection)
-        self.ui.lb.see(selection)
+        lb.selection_set(selection)
+        lb.see(selection)
         return(len(self.tasks))
     
+    def ui_diff_tasks_list(self, rows):
+        "Update the listbox from the displayed rows to the new rows"
+        lb = self.ui.lb
+        keep = set(r[0] for r in rows)
+        old = [r for r in self.rows if r[0] in keep]
+        changes = len(self.rows) + len(rows) - 2 * len(old)
+        if changes > max(len(self.rows), len(rows)) // 2:
+            # mostly different rows (new view) : replace everything
+            lb.delete(0, END)
+            lb.insert(0, *[r[1] for r in rows])
+            self.ui_style_rows(0, rows)
+            return
+        # delete the rows which disappeared, by ranges from the end
+        i = len(self.rows)
+        while i > 0:
+            i -= 1
+            if self.rows[i][0] not in keep:
+                j = i
+                while i > 0 and self.rows[i - 1][0] not in keep:
+                    i -= 1
+                lb.delete(i, j)
+        # then insert/move/restyle the others (a cheap diff, both lists mostly match)
+        matcher = SequenceMatcher(None, [r[0] for r in old], [r[0] for r in rows], autojunk=False)
+        for op, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if op == 'equal':
+                for i, j in zip(range(i1, i2), range(j1, j2)):
+                    if old[i][1] != rows[j][1]:
+                        lb.delete(i)
+                        lb.insert(i, rows[j][1])
+                        lb.itemconfig(i, fg=rows[j][2], bg=rows[j][3])
+                    elif old[i][2:] != rows[j][2:]:
+                        lb.itemconfig(i, fg=rows[j][2], bg=rows[j][3])
+                continue
+            if op in ('delete', 'replace'):
+                lb.delete(i1, i2 - 1)
+            if op in ('insert', 'replace'):
+                lb.insert(i1, *[r[1] for r in rows[j1:j2]])
+                self.ui_style_rows(i1, rows[j1:j2])
+
     def ui_load_tasks_list(self, archives):
         "Load the tasks list"
-        l = self.db_get_tasks_list(archives, self.mask.get())
-        teams = self.get_teams()
-        i = 0
-        for id, task, milestone, active, done, urgent, team, date, updated in l:
+        start = prof.start()
+        rows = self.ui_get_tasks_rows(archives)
+        prof.stop("query", start, len(rows))
+        start = prof.start()
+        self.ui.lb.delete(0, END)
+        self.ui.lb.insert(0, *[r[1] for r in rows])
+        self.ui_style_rows(0, rows)
+        self.ui_set_tasks_rows(rows)
+        prof.stop("reload", start, len(rows))
+        self.ui_display_counts()
+        self.archives = archives
+        self.view = (archives, self.mask.get(), self.order)
+        return(True)
+
+    def ui_load_next_page(self):
+        "Append the next page of archived tasks to the list"
+        self.page_job = None
+        if self.page_after is None or not self.archives:
+            return
+        page = self.db_get_tasks_list(True, self.mask.get(), self.order, self.page_after, ARCHIVES_PAGE)
+        self.page_after = page[-1] if len(page) == ARCHIVES_PAGE else None
+        rows = self.ui_get_tasks_rows(True, page, extend=True)
+        first = len(self.rows)
+        self.ui.lb.insert(END, *[r[1] for r in rows])
+        self.ui_style_rows(first, rows)
+        self.rows.extend(rows)
+        for i, r in enumerate(rows, first):
+            self.tasks[str(i)] = r[0]
+            self.sksat[r[0]] = str(i)
+        self.ui_display_log("{0} archived tasks displayed".format(len(self.rows)))
+
+    def ui_scrolled(self, first, last):
+        "Move the scrollbar, load the next page of archives near the end of the list"
+        self.ui.sl.set(first, last)
+        if self.page_after is not None and self.page_job is None and float(last) > 0.9:
+            self.page_job = self.ui.after_idle(self.ui_load_next_page)
+
+    def ui_get_selected_ids(self):
+        "Get the ids of the selected tasks"
+        return([self.tasks[str(i)] for i in self.ui.lb.curselection()])
+
+    def ui_set_tasks_rows(self, rows):
+        "Set the displayed rows and rebuild the index maps"
+        self.rows = rows
+        self.tasks.clear()
+        self.sksat.clear()
+        for i, r in enumerate(rows):
+            self.tasks[str(i)] = r[0]
+            self.sksat[r[0]] = str(i)
+
+    def ui_get_page_limit(self, archives, mask):
+        "Number of archived tasks to load (None : all the tasks)"
+        if not archives or self.order != "milestone":
+            return(None)
+        if self.view == (archives, mask, self.order):
+            # same view : reload the pages already displayed
+            return(max(ARCHIVES_PAGE, len(self.rows)))
+        return(ARCHIVES_PAGE)
+
+    def ui_get_tasks_rows(self, archives, data=None, extend=False):
+        "Get the tasks list (or the given tasks rows) as displayed rows (id, label, fg, bg)"
+        limit = self.ui_get_page_limit(archives, self.mask.get())
+        if data is None:
+            l = self.db_get_tasks_list(archives, self.mask.get(), self.order, limit=limit)
+        else:
+            l = data
+        if not extend:
+            # a full page : there are maybe more archived tasks
+            self.page_after = l[-1] if limit and len(l) >= ARCHIVES_PAGE else None
+            self.repo.load(l)
+        else:
+            self.repo.extend(l)
+        styles = self.styles
+        now = today_ordinal()
+        rows = []
+        for id, task, milestone, active, done, urgent, team, date, updated, due in l:
             if not date:
                 date = '----------'
             if archives:
@@ -639,41 +811,100 @@ class to_do_app(object):
                 lbl = "{}|{}".format(str(milestone).ljust(8), task)
             else:
                 lbl = "{}|{}|{}|{} ({})".format(str(milestone).ljust(8),str(updated).ljust(10), str(date).ljust(10), task, team)
-            self.ui.lb.insert(i, lbl)
-            if archives:
-                self.ui.lb.itemconfig(i, fg="black", bg="white")
-            elif int(done) > 0:
-                self.ui.lb.itemconfig(i, fg='#A4A4A4', bg='white')
-            elif int(urgent) > 0:
-                self.ui.lb.itemconfig(i, fg='white', bg='red')
-            elif team == 'N/A' and len(task) > 1 and task[0] == "*":
-                self.ui.lb.itemconfig(i, fg='black', bg='#EEE')
-            elif team != 'VAL' and is_urgent(date):
-                self.ui.lb.itemconfig(i, fg='white', bg='red')
-            elif team in teams:
-                t_fg, t_bg = teams[team]
-                self.ui.lb.itemconfig(i, fg=t_fg, bg=t_bg) 
+            state = (archives, done, urgent, team, due is not None and due <= now, len(task) > 1 and task[0] == "*")
+            style = styles.get(state) or self.ui_get_style(state)
+            rows.append((id, lbl) + style)
+        return(rows)
+
+    def ui_get_style(self, state):
+        "Get the colors (fg, bg) of a task state (archives, done, urgent, team, overdue, note)"
+        archives, done, urgent, team, overdue, note = state
+        teams = self.get_teams()
+        if archives:
+            fg, bg = "black", "white"
+        elif int(done) > 0:
+            fg, bg = '#A4A4A4', 'white'
+        elif int(urgent) > 0:
+            fg, bg = 'white', 'red'
+        elif team == 'N/A' and note:
+            fg, bg = 'black', '#EEE'
+        elif team != 'VAL' and overdue:
+            fg, bg = 'white', 'red'
+        elif team in teams:
+            fg, bg = teams[team]
+        else:
+            fg, bg = "black", "white"
+        self.styles[state] = (fg, bg)
+        return((fg, bg))
+
+    def ui_style_rows(self, first, rows):
+        "Set the colors of the rows displayed from first, in one call by style"
+        lb = self.ui.lb
+        groups = dict()
+        for i, r in enumerate(rows, first):
+            groups.setdefault(r[2:], []).append(i)
+        for (fg, bg), indexes in groups.items():
+            if hasattr(lb, "itemconfig_many"):
+                lb.itemconfig_many(indexes, fg, bg)
             else:
-                self.ui.lb.itemconfig(i, fg="black", bg="white")
-            self.tasks[str(i)] = id
-            self.sksat[id] = str(i)
-            i = i+1
-        return(True)
+                listbox_itemconfig_many(lb, indexes, fg, bg)
 
     def ui_display_log(self, msg):
         "Display ui_display_log in status bar"
         debug([msg])
         self.ui.sb.ui_display_log.configure(text="{0}".format(msg))
 
+    def ui_display_pending(self):
+        "Display the write-behind state in status bar"
+        if self.pending and self.flush_locked:
+            self.ui.sb.wb.configure(text="{0} change(s) pending, database locked, retrying…".format(self.pending))
+        elif self.pending:
+            self.ui.sb.wb.configure(text="{0} change(s) pending".format(self.pending))
+        else:
+            self.ui.sb.wb.configure(text="Saved")
+
+    def ui_display_counts(self):
+        "Display the open (and urgent) tasks counts on the team/milestone buttons, the totals in status bar"
+        totals = [0, 0, 0]
+        for kind, tg in (("team", self.ui.tg1), ("milestone", self.ui.tg2)):
+            counts = self.db_get_counts(kind)
+            for name, button in tg.buttons.items():
+                tasks, done, urgent = counts.get(name, (0, 0, 0))
+                badge = " {0}".format(tasks - done) if tasks > done else ""
+                if urgent:
+                    badge += " ({0}!)".format(urgent)
+                button.configure(text="{0}{1}".format(name, badge))
+            if kind == "team":
+                # every task has one team (maybe none)
+                totals = [sum(c[i] for c in counts.values()) for i in range(3)]
+        tasks, done, urgent = totals
+        self.ui.sb.cnt.configure(text="{0} open, {1} done, {2} urgent".format(tasks - done, done, urgent))
+
+    def ui_poll_changes(self):
+        "Reload the list when another instance changed the database"
+        version = self.db_get_data_version()
+        if version != self.data_version:
+            self.data_version = version
+            self.clear_teams()
+            self.ui_reload_tasks_list(self.archives)
+            self.ui_display_log("Database changed by another instance, reloaded !")
+        self.ui.after(SHARED_POLL, self.ui_poll_changes)
+
+    def ui_display_profile(self):
+        "Display the rolling profile summary in status bar"
+        self.ui.sb.prof.configure(text=prof.summary())
+        self.ui.after(PROFILE_REFRESH, self.ui_display_profile)
+
     def ui_draw_team_buttons(self, ui):
         "Draw team toolbar"
         tg= Frame(ui)
         tg.pack(fill=X)
-        l = self.db_get_teams()
-        for team, fg, bg, active in l:
+        tg.buttons = dict()
+        for team, (fg, bg) in self.get_teams().items():
             tg.team = Button(tg, text=team, fg=fg, bg=bg)
             tg.team.configure(command=lambda k=str(team): self.cb_set_task_team(k))
             tg.team.pack(side=LEFT, padx=2, pady=2)
+            tg.buttons[team] = tg.team
         return(tg)
 
     def ui_draw_milestone_buttons(self, ui):
@@ -681,12 +912,30 @@ class to_do_app(object):
         tg= Frame(ui)
         tg.pack(fill=X)
         l = self.db_get_milestones()
+        tg.buttons = dict()
         for milestone, active in l:
             tg.milestone = Button(tg, text=milestone)
             tg.milestone.configure(command=lambda k=str(milestone): self.cb_set_task_milestone(k))
             tg.milestone.pack(side=LEFT, padx=2, pady=2)
+            tg.buttons[milestone] = tg.milestone
         return(tg)
 
+    def ui_draw_found_window(self, rows, mask):
+        "Display the tasks found in the workspaces (double-click : open the task)"
+        w = Toplevel(self.ui)
+        w.title("{0} - '{1}'".format(self.program, mask))
+        w.sl = Scrollbar(w, orient=VERTICAL)
+        w.lb = Listbox(w, width=100, height=30, font="fixed", yscrollcommand=w.sl.set)
+        w.sl.config(command=w.lb.yview)
+        w.sl.pack(side=RIGHT, fill=Y)
+        w.lb.pack(side=LEFT, expand=True, fill='both')
+        w.lb.insert(END, *["{0}|{1}|{2} ({3})".format(source.ljust(10), str(milestone).ljust(8), task, team)
+                           for source, id, task, milestone, active, done, urgent, team, date, updated, due in rows])
+        w.lb.bind("<Double-Button-1>", lambda e: self.cb_open_found_task(rows, w.lb.curselection()))
+        w.lb.bind("<Return>", lambda e: self.cb_open_found_task(rows, w.lb.curselection()))
+        w.lb.focus_set()
+        return(w)
+
     def ui_draw_window(self):
         "Draw the UI"
         ui = Tk()
@@ -737,11 +986,20 @@ class to_do_app(object):
         ui.fb.src.pack(side=LEFT, padx=2, pady=2)
         ui.fb.but = Button(ui.fb, text="Filtrer", width=8, command=self.cb_filter)
         ui.fb.but.pack(side=LEFT, padx=2, pady=2)
+        ui.fb.ord = Button(ui.fb, text="Tri date", width=8, command=self.cb_toggle_order)
+        ui.fb.ord.pack(side=LEFT, padx=2, pady=2)
+        if len(self.workspaces) > 1:
+            self.workspace = StringVar()
+            self.workspace.set(workspace_name(self.dbfile))
+            ui.fb.ws = OptionMenu(ui.fb, self.workspace, *[workspace_name(f) for f in self.workspaces], command=self.cb_switch_workspace)
+            ui.fb.ws.pack(side=LEFT, padx=2, pady=2)
+            ui.fb.all = Button(ui.fb, text="Chercher tout", width=12, command=self.cb_search_workspaces)
+            ui.fb.all.pack(side=LEFT, padx=2, pady=2)
         self.filter = True
         ui.fb.ex = Button(ui.fb, text="Importer", width=8, command=self.cb_import_csv)
         ui.fb.ex.pack(side=LEFT,  padx=2, pady=2)
-        ui.fb.ex = Button(ui.fb, text="Exporter", width=8, command=self.cb_export_csv)
-        ui.fb.ex.pack(side=LEFT, padx=2, pady=2)
+        ui.fb.exp = Button(ui.fb, text="Exporter", width=8, command=self.cb_export_csv)
+        ui.fb.exp.pack(side=LEFT, padx=2, pady=2)
         ui.fb.no = Button(ui.fb, text="Notes", width=8, command=self.cb_copy_notes)
         ui.fb.no.pack(side=LEFT, padx=2, pady=2)
         ui.fb.re = Button(ui.fb, text="Relancer", width=8, command=self.cb_restart)
@@ -750,7 +1008,10 @@ class to_do_app(object):
         ui.cf = Frame(ui)
         ui.cf.pack(fill=BOTH, expand=True)
         ui.sl = Scrollbar(ui.cf, orient=VERTICAL)
-        ui.lb = Listbox(ui.cf, selectmode=EXTENDED, yscrollcommand=ui.sl.set)
+        if VIRTUAL:
+            ui.lb = virtual_list(ui.cf, selectmode=EXTENDED, yscrollcommand=self.ui_scrolled)
+        else:
+            ui.lb = Listbox(ui.cf, selectmode=EXTENDED, yscrollcommand=self.ui_scrolled)
         ui.lb.config(font="fixed")
         ui.sl.config(command=ui.lb.yview)
         ui.sl.pack(side=RIGHT, fill=Y)
@@ -760,6 +1021,17 @@ class to_do_app(object):
         ui.sb.pack(fill=X)
         ui.sb.ui_display_log = Label(ui.sb, anchor=W, justify=LEFT)
         ui.sb.ui_display_log.pack(side=LEFT, expand=True, fill='both', padx=2, pady=2)
+        ui.sb.wb = Label(ui.sb, anchor=E, text="Saved")
+        ui.sb.wb.pack(side=RIGHT, padx=2, pady=2)
+        ui.sb.cnt = Label(ui.sb, anchor=E)
+        ui.sb.cnt.pack(side=RIGHT, padx=2, pady=2)
+        if prof.enabled:
+            # click : save the profile
+            ui.sb.prof = Label(ui.sb, anchor=E, fg="grey")
+            ui.sb.prof.pack(side=RIGHT, padx=2, pady=2)
+            ui.sb.prof.bind("<Button-1>", self.cb_save_profile)
+            ui.after(PROFILE_REFRESH, self.ui_display_profile)
+        ui.protocol("WM_DELETE_WINDOW", self.cb_quit)
         # Shorcut
         ui.bind("<F1>", self.cb_new_task)
         ui.lb.bind("<F2>", self.cb_copy_task)
@@ -777,20 +1049,275 @@ class to_do_app(object):
         ui.lb.bind("<space>", self.cb_display_task)
         ui.lb.bind("<n>", self.cb_copy_notes)
         ui.fb.src.bind("<Return>", self.cb_filter)
+        self.mask.trace_add("write", self.cb_live_filter)
         ui.lb.bind("<Double-Button-1>", self.cb_edit_task)
         ui.lb.bind("<Button-3>", self.cb_display_task)
         ui.lb.bind("<Button-2>", self.cb_toggle_task_urgent)
         return(ui)
 
 
+class virtual_list(object):
+
+    "Listbox rendering only the visible window of its rows"
+
+    def __init__(self, master, yscrollcommand=None, overscan=OVERSCAN, **options):
+        "Create the inner listbox"
+        self.lb = Listbox(master, **options)
+        self.yscrollcommand = yscrollcommand
+        self.overscan = overscan
+        # rows data
+        self.labels = []
+        self.styles = []
+        self.selected = set()
+        # window : rows start to end are in the listbox, top is the first visible
+        self.top = 0
+        self.start = 0
+        self.end = 0
+        self.active = 0
+        self.anchor = 0
+        self.job = None
+        self.lb.configure(yscrollcommand=self.vl_sync)
+        self.lb.bind("<<ListboxSelect>>", self.vl_select)
+        self.lb.bind("<Configure>", self.vl_schedule_render)
+        self.lb.bind("<Button-1>", self.vl_click)
+        self.lb.bind("<Control-Button-1>", self.vl_control_click)
+        self.lb.bind("<Shift-Button-1>", self.vl_shift_click)
+        self.lb.bind("<Up>", self.vl_key)
+        self.lb.bind("<Down>", self.vl_key)
+        self.lb.bind("<Control-Home>", lambda e: self.vl_goto(0))
+        self.lb.bind("<Control-End>", lambda e: self.vl_goto(END))
+
+    ### LISTBOX INTERFACE ###########################################
+
+    def insert(self, index, *labels):
+        "Insert rows before index"
+        i = len(self.labels) if index == END else int(index)
+        n = len(labels)
+        self.labels[i:i] = labels
+        self.styles[i:i] = [(None, None)] * n
+        self.selected = set(k + n if k >= i else k for k in self.selected)
+        self.vl_schedule_render()
+
+    def delete(self, first, last=None):
+        "Delete rows first to last (included)"
+        i = self.vl_index(first)
+        j = i if last is None else self.vl_index(last)
+        if j < i:
+            return
+        n = j - i + 1
+        del self.labels[i:j + 1]
+        del self.styles[i:j + 1]
+        self.selected = set(k - n if k > j else k for k in self.selected if k < i or k > j)
+        self.vl_schedule_render()
+
+    def itemconfig(self, index, fg=None, bg=None):
+        "Set the colors of a row"
+        self.styles[self.vl_index(index)] = (fg, bg)
+        self.vl_schedule_render()
+
+    def itemconfig_many(self, indexes, fg=None, bg=None):
+        "Set the colors of several rows"
+        style = (fg, bg)
+        for i in indexes:
+            self.styles[i] = style
+        self.vl_schedule_render()
+
+    def size(self):
+        "Return the number of rows"
+        return(len(self.labels))
+
+    def curselection(self):
+        "Return the selected rows"
+        return(tuple(sorted(self.selected)))
+
+    def selection_set(self, first, last=None):
+        "Select rows first to last"
+        if not self.labels:
+            return
+        i = self.vl_index(first)
+        j = i if last is None else self.vl_index(last)
+        self.selected.update(range(i, j + 1))
+        self.active = self.anchor = j
+        self.vl_schedule_render()
+
+    def selection_clear(self, first, last=None):
+        "Unselect rows first to last"
+        i = self.vl_index(first)
+        j = i if last is None else self.vl_index(last)
+        self.selected = set(k for k in self.selected if k < i or k > j)
+        self.vl_schedule_render()
+
+    def see(self, index):
+        "Scroll to make the row visible"
+        i = self.vl_index(index)
+        visible = self.vl_visible()
+        if i < self.top:
+            self.top = i
+        elif i >= self.top + visible:
+            self.top = i - visible + 1
+        self.vl_schedule_render()
+
+    def nearest(self, y):
+        "Return the row nearest to y"
+        if not self.labels:
+            return(-1)
+        if self.job is None and self.end > self.start:
+            return(self.start + self.lb.nearest(y))
+        return(self.top)
+
+    def yview(self, *args):
+        "Query or change the vertical position (scrollbar command)"
+        total = len(self.labels)
+        visible = self.vl_visible()
+        if not args:
+            if not total:
+                return((0.0, 1.0))
+            return((self.top / total, min(1.0, (self.top + visible) / total)))
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * total)
+        elif args[0] == 'scroll':
+            step = visible if args[2].startswith('page') else 1
+            self.top += int(args[1]) * step
+        else:
+            self.top = self.vl_index(args[0])
+        self.vl_render()
+
+    def focus_set(self):
+        "Give the focus to the listbox"
+        self.lb.focus_set()
+
+    def bind(self, sequence, func, add=None):
+        "Bind an event on the listbox"
+        return(self.lb.bind(sequence, func, add))
+
+    def config(self, **options):
+        "Configure the listbox"
+        self.lb.config(**options)
+
+    def pack(self, **options):
+        "Pack the listbox"
+        self.lb.pack(**options)
+
+    ### WINDOW ######################################################
+
+    def vl_index(self, index):
+        "Convert a listbox index to a row number"
+        if index == END:
+            return(len(self.labels) - 1)
+        return(int(index))
+
+    def vl_visible(self):
+        "Return the number of rows the listbox can display"
+        box = self.lb.bbox(self.lb.nearest(0)) if self.end > self.start else None
+        if not box:
+            return(self.overscan)
+        return(self.lb.winfo_height() // max(box[3], 1) + 1)
+
+    def vl_schedule_render(self, event=None):
+        "Render the window once the pending changes are done"
+        if self.job is None:
+            self.job = self.lb.after_idle(self.vl_render)
+
+    def vl_render(self):
+        "Fill the listbox with the rows around top"
+        if self.job is not None:
+            self.lb.after_cancel(self.job)
+            self.job = None
+        start = prof.start()
+        total = len(self.labels)
+        visible = self.vl_visible()
+        self.top = max(0, min(self.top, total - visible))
+        self.start = max(0, self.top - self.overscan)
+        self.end = min(total, self.top + visible + self.overscan)
+        lb = self.lb
+        lb.delete(0, END)
+        if self.end > self.start:
+            lb.insert(0, *self.labels[self.start:self.end])
+            groups = dict()
+            for i in range(self.start, self.end):
+                groups.setdefault(self.styles[i], []).append(i - self.start)
+            for (fg, bg), indexes in groups.items():
+                if fg or bg:
+                    listbox_itemconfig_many(lb, indexes, fg, bg)
+            for i in self.selected:
+                if self.start <= i < self.end:
+                    lb.selection_set(i - self.start)
+            if self.start <= self.active < self.end:
+                lb.activate(self.active - self.start)
+            if self.start <= self.anchor < self.end:
+                lb.selection_anchor(self.anchor - self.start)
+        lb.yview(self.top - self.start)
+        if self.yscrollcommand:
+            self.yscrollcommand(*self.yview())
+        prof.stop("render", start, self.end - self.start)
+
+    def vl_sync(self, first, last):
+        "Follow the scrolling of the listbox, move the window near its edges"
+        if self.job is not None or not self.lb.winfo_ismapped():
+            return
+        self.top = self.start + self.lb.nearest(0)
+        margin = self.overscan // 2
+        bottom = self.top + self.vl_visible()
+        if (self.top - self.start < margin and self.start > 0) or \
+           (self.end - bottom < margin and self.end < len(self.labels)):
+            self.vl_render()
+        elif self.yscrollcommand:
+            self.yscrollcommand(*self.yview())
+
+    def vl_window_selection(self):
+        "Keep only the selected rows of the window"
+        self.selected = set(k for k in self.selected if self.start <= k < self.end)
+
+    def vl_select(self, event=None):
+        "Copy the selection of the window in the rows (the rows outside the window are kept)"
+        shown = set(self.start + i for i in self.lb.curselection())
+        self.selected = set(k for k in self.selected if not self.start <= k < self.end) | shown
+        self.active = self.start + self.lb.index(ACTIVE)
+
+    def vl_click(self, event):
+        "Event click : the selection is replaced"
+        self.vl_window_selection()
+        self.anchor = self.start + self.lb.nearest(event.y)
+
+    def vl_control_click(self, event):
+        "Event control-click : the selection is extended by the listbox"
+        self.anchor = self.start + self.lb.nearest(event.y)
+
+    def vl_shift_click(self, event):
+        "Event shift-click : select from the anchor, even outside the window"
+        i = self.start + self.lb.nearest(event.y)
+        self.selected = set(range(min(i, self.anchor), max(i, self.anchor) + 1))
+        self.active = i
+        self.vl_render()
+        self.lb.event_generate("<<ListboxSelect>>")
+        return("break")
+
+    def vl_key(self, event):
+        "Event up/down : the selection is replaced"
+        self.vl_window_selection()
+
+    def vl_goto(self, index):
+        "Select a single row and scroll to it"
+        if self.labels:
+            self.selected = set()
+            self.selection_set(index)
+            self.see(index)
+        return("break")
+
+
 class console(object):
     
     "Class for console"
     
-    def __init__(self, db, master):
+    def __init__(self, dbfile, master):
         "Start the console"
-        self.db = db
+        self.dbfile = dbfile
         self.master = master
+        self.more = False
+        self.busy = False
+        self.count = 0
+        self.elapsed = 0
+        self.worker = None
         self.ui = self.console_draw_ui()
         self.ui.term.insert(END ,"  _____ ___  _   _  ____  ___  _      ____  \n")
         self.ui.term.insert(END ," / ____/ _ \| \ | |/ ___|/ _ \| |    |___ \ \n")
@@ -801,32 +1328,91 @@ class console(object):
         self.ui.term.insert(END ,"                                            \n")
         self.ui.term.insert(END ,"\n")
         self.ui.term.insert(END ,"Type your request and press <Enter>.\n")
+        self.ui.term.insert(END ,"Results are displayed by pages, press <PageDown> for the next page.\n")
+        self.ui.term.insert(END ,"Press <Escape> to cancel a request.\n")
+        self.console_start_worker()
         self.ui.mainloop()
-    
+
+    def console_start_worker(self):
+        "Start a worker (and a connection) for the read-only mode"
+        if self.worker:
+            self.worker.stop()
+        readonly = bool(self.ui.ro.get())
+        self.worker = console_worker(self.dbfile, readonly)
+        self.worker.start()
+        self.more = False
+        self.ui.term.insert(END ,"-- Database opened{0}.\n".format(" read-only" if readonly else ""))
+        self.ui.term.see(END)
+
     def console_execute_sql(self, event=None):
         "Execute request"
-        sql = self.ui.cmd.get()
+        sql = self.ui.cmd.get().strip()
+        if not sql or self.busy:
+            return
+        self.ui.term.insert(END ,">>> {0}\n".format(sql))
+        self.ui.term.see(END)
+        self.count = 0
+        self.elapsed = 0
+        self.worker.execute(sql)
+        self.console_wait()
+
+    def console_more(self, event=None):
+        "Event display the next page of the result"
+        if self.more and not self.busy:
+            self.worker.fetch()
+            self.console_wait()
+
+    def console_cancel(self, event=None):
+        "Event cancel the running request"
+        if self.busy:
+            self.worker.cancel()
+
+    def console_wait(self):
+        "Wait (without blocking) for the worker's result"
+        self.busy = True
         self.ui.cmd.configure(state = 'disabled')
-        res = False
-        if sql:
-            try:
-                sql = sql.strip()
-                cur = self.db.execute(sql)
-                self.ui.term.insert(END ,">>> {0}\n".format(sql))
-                self.db.commit()
-                res = cur.fetchall()
-            except SqlError as e:
-                msg = "{0}".format(e.args[0])
-                self.ui.term.insert(END ,"{0}\n".format(msg))
+        self.ui.rob.configure(state = 'disabled')
+        self.ui.after(20, self.console_poll)
+
+    def console_poll(self):
+        "Display the worker's result when it is ready"
+        try:
+            kind, res, elapsed = self.worker.results.get_nowait()
+        except Empty:
+            self.ui.after(20, self.console_poll)
+            return
+        self.elapsed += elapsed
+        self.more = False
+        if kind == "error":
+            self.ui.term.insert(END ,"{0}\n".format(res))
+        elif kind == "done":
+            self.ui.term.insert(END ,"-- {0} row(s) affected in {1:.3f}s\n".format(res, self.elapsed))
+        else:
+            self.console_display_page(res)
         self.ui.term.see(END)
-        if res:
-            for l in res:
-                l=str(l)
-                self.ui.term.insert(END ,l+"\n")
-                self.ui.term.see(END)
+        self.busy = False
         self.ui.cmd.configure(state = 'normal')
+        self.ui.rob.configure(state = 'normal')
         self.ui.cmd.focus()
 
+    def console_display_page(self, res):
+        "Display a page of the result"
+        if res:
+            self.ui.term.insert(END, "".join(str(l) + "\n" for l in res))
+        self.count += len(res)
+        if len(res) == CONSOLE_PAGE:
+            self.more = True
+            self.ui.term.insert(END ,"-- {0} row(s) in {1:.3f}s, more… (<PageDown>)\n".format(self.count, self.elapsed))
+        elif self.count >= CONSOLE_ROWS:
+            self.ui.term.insert(END ,"-- {0} row(s) in {1:.3f}s, truncated\n".format(self.count, self.elapsed))
+        else:
+            self.ui.term.insert(END ,"-- {0} row(s) in {1:.3f}s\n".format(self.count, self.elapsed))
+
+    def console_close(self):
+        "Event close the console"
+        self.worker.stop()
+        self.ui.destroy()
+
     def console_draw_ui(self):
         "Draw the UI"
         ui = Tk()
@@ -837,7 +1423,13 @@ class console(object):
         # Barre commande
         ui.cmd = Entry(ui)
         ui.cmd.pack(side=LEFT, fill=BOTH, expand=1)
+        ui.ro = IntVar(ui, value=int(CONSOLE_READONLY))
+        ui.rob = Checkbutton(ui, text="Lecture seule", variable=ui.ro, command=self.console_start_worker)
+        ui.rob.pack(side=RIGHT)
         ui.bind('<Return>', self.console_execute_sql)
+        ui.bind('<Next>', self.console_more)
+        ui.bind('<Escape>', self.console_cancel)
+        ui.protocol("WM_DELETE_WINDOW", self.console_close)
         ui.cmd.focus()
         return(ui)
     
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#---------------------------------------------------------------------
+# PARAM
+#---------------------------------------------------------------------
+
+# database sizes (number of tasks), fraction of archived tasks
+SIZES = [1000, 10000, 100000]
+ARCHIVED = 0.3
+
+# runs per operation (the best time is kept)
+REPEAT = 3
+
+# tasks toggled by the multi-selection benchmark
+SELECTION = 200
+
+#---------------------------------------------------------------------
+# PROGRAM
+#---------------------------------------------------------------------
+
+DOCHELP = """
+Benchmarks of 2do : builds synthetic 2do_bench_<size>.db databases and
+times the list queries, the listbox population, the toggles and the
+CSV import/export. The results are printed as JSON to compare releases.
+
+The listbox is a hidden Tk window when a display is available, else a
+stand-in recording the Listbox calls.
+"""
+
+
+#---------------------------------------------------------------------
+# SOURCE CODE
+#---------------------------------------------------------------------
+
+from os import remove
+from os.path import dirname
+from os.path import isfile
+from os.path import join
+from os.path import abspath
+from random import Random
+from datetime import date
+from datetime import timedelta
+from shutil import copyfile
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import perf_counter
+from json import dumps
+from sys import stderr
+from sys import version as python_version
+from sqlite3 import sqlite_version
+from argparse import ArgumentParser
+from importlib.util import spec_from_file_location
+from importlib.util import module_from_spec
+import todo_core
+
+
+def load_2do():
+    "Import the window 2do.py (not a valid module name) from the same directory"
+    spec = spec_from_file_location("todo", join(dirname(abspath(__file__)), "2do.py"))
+    todo = module_from_spec(spec)
+    spec.loader.exec_module(todo)
+    return(todo)
+
+todo = load_2do()
+
+
+### SYNTHETIC DATABASE ##############################################
+
+TEAMS = [("ANA", 20), ("DEV", 25), ("COR", 15), ("QAL", 10), ("CHF", 8),
+         ("Q/R", 5), ("RE7", 4), ("ARB", 4), ("VAL", 6), ("N/A", 3)]
+MILESTONES = ["", "v1.0", "v1.1", "v1.2", "v2.0", "v2.1", "v2.2", "v3.0", "backlog", "support"]
+VERBS = ["fix", "write", "review", "check", "update", "test", "deploy", "remove", "merge", "document"]
+NOUNS = ["report", "login", "invoice", "export", "import", "database", "screen", "printer",
+         "customer", "planning", "backup", "release", "server", "mail", "archive", "search"]
+
+def gen_task(rnd, n, first, archived):
+    "Generate a tasks row (task, milestone, active, done, urgent, team, date, updated)"
+    team = rnd.choices([t for t, w in TEAMS], [w for t, w in TEAMS])[0]
+    # a few milestones hold most of the tasks
+    milestone = rnd.choices(MILESTONES, [1 / (k + 1) for k in range(len(MILESTONES))])[0]
+    task = "{0} - {1} {2} {3}".format(n, rnd.choice(VERBS), rnd.choice(NOUNS), rnd.choice(NOUNS))
+    done = 1 if rnd.random() < (0.9 if archived else 0.35) else 0
+    urgent = 1 if rnd.random() < 0.05 else 0
+    due = None
+    if rnd.random() < 0.5:
+        due = (first + timedelta(days=rnd.randrange(730))).strftime("%d/%m/%Y")
+    updated = (first + timedelta(days=rnd.randrange(365))).strftime("%d/%m/%Y")
+    return((task, milestone, 0 if archived else 1, done, urgent, team, due, updated))
+
+def gen_database(path, size, archived=ARCHIVED, seed=2):
+    "Build a database of size tasks"
+    if isfile(path):
+        remove(path)
+    core = todo_core.to_do_core(path)
+    rnd = Random(seed)
+    first = date.today() - timedelta(days=365)
+    rows = [(n + 1, ) + gen_task(rnd, n, first, rnd.random() < archived) for n in range(size)]
+    sql = "INSERT INTO {0} (rowid, task, milestone, active, done, urgent, team, date, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);"
+    with core.db:
+        core.db.executemany(sql.format("tasks"), (r for r in rows if r[3]))
+        core.db.executemany(sql.format("archives"), (r for r in rows if not r[3]))
+    core.db.execute("ANALYZE;")
+    core.db_close()
+
+
+### DISPLAY STAND-IN ################################################
+
+class standin(object):
+
+    "Widget stand-in accepting (and ignoring) any call"
+
+    def __getattr__(self, name):
+        "Return a widget for sub-widgets and methods"
+        w = standin()
+        setattr(self, name, w)
+        return(w)
+
+    def __call__(self, *args, **options):
+        "Ignore the call"
+        return(None)
+
+
+class standin_listbox(standin):
+
+    "Listbox stand-in : keeps the rows and counts the calls"
+
+    def __init__(self):
+        "Initialize the listbox"
+        self.items = []
+        self.selected = set()
+        self.calls = 0
+
+    def vl_index(self, index):
+        "Convert a listbox index"
+        return(len(self.items) - 1 if index == "end" else int(index))
+
+    def insert(self, index, *labels):
+        "Insert rows"
+        i = len(self.items) if index == "end" else int(index)
+        self.items[i:i] = labels
+        self.calls += 1
+
+    def delete(self, first, last=None):
+        "Delete rows"
+        i = self.vl_index(first)
+        j = i if last is None else self.vl_index(last)
+        del self.items[i:j + 1]
+        self.selected = set()
+        self.calls += 1
+
+    def itemconfig(self, index, **options):
+        "Set the colors of a row"
+        self.calls += 1
+
+    def itemconfig_many(self, indexes, fg, bg):
+        "Set the colors of several rows"
+        self.calls += 1
+
+    def size(self):
+        "Return the number of rows"
+        return(len(self.items))
+
+    def nearest(self, y):
+        "Return the top row"
+        return(0 if self.items else -1)
+
+    def curselection(self):
+        "Return the selected rows"
+        return(tuple(sorted(self.selected)))
+
+    def selection_set(self, first, last=None):
+        "Select rows"
+        if self.items:
+            i = self.vl_index(first)
+            j = i if last is None else self.vl_index(last)
+            self.selected.update(range(i, j + 1))
+
+    def selection_clear(self, first, last=None):
+        "Unselect all the rows"
+        self.selected = set()
+
+
+class standin_var(object):
+
+    "StringVar stand-in"
+
+    def __init__(self, value):
+        "Initialize the variable"
+        self.value = value
+
+    def get(self):
+        "Get the value"
+        return(self.value)
+
+    def set(self, value):
+        "Set the value"
+        self.value = value
+
+
+class standin_ui(standin):
+
+    "Main window stand-in"
+
+    def __init__(self):
+        "Initialize the window"
+        self.lb = standin_listbox()
+        # team/milestone toolbars without buttons
+        self.tg1 = standin()
+        self.tg1.buttons = dict()
+        self.tg2 = standin()
+        self.tg2.buttons = dict()
+
+    def after(self, ms, func=None, *args):
+        "Timers are not run"
+        return("after#0")
+
+    def update_idletasks(self):
+        "Nothing to render"
+        pass
+
+
+def bench_app(path):
+    "Open the application on the database, with a hidden window or the stand-in"
+    # NameError : tkinter is missing, TclError : no display
+    app = todo.to_do_app.__new__(todo.to_do_app)
+    app.flush_job = None
+    todo_core.to_do_core.__init__(app, path)
+    app.program = "2do bench"
+    app.version = todo_core.VERSION
+    app.dochelp = DOCHELP
+    app.ui_init_variables()
+    try:
+        app.ui = app.ui_draw_window()
+        app.ui.withdraw()
+        display = "tk (virtual list)" if todo.VIRTUAL else "tk"
+    except (NameError, getattr(todo, "TclError", NameError)):
+        app.ui = standin_ui()
+        app.mask = standin_var("%")
+        display = "stand-in"
+    app.archives = False
+    return(app, display)
+
+
+### BENCHMARKS ######################################################
+
+def timed(func, repeat):
+    "Run func repeat times, return (best time, last result)"
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        r = func()
+        t = perf_counter() - start
+        best = t if best is None else min(best, t)
+    return(best, r)
+
+def bench_size(path, size, repeat, tmp):
+    "Time the operations on a database, return the results"
+    results = []
+    def record(op, func, rows=None, n=repeat):
+        t, r = timed(func, n)
+        rows = rows if rows is not None else (r if isinstance(r, int) else None)
+        results.append({"size": size, "op": op, "seconds": round(t, 6), "rows": rows})
+        print("{0:>8} {1:<32} {2:>10.4f}s {3}".format(size, op, t, "" if rows is None else rows), file=stderr)
+    # work on a copy, the toggles write in the database
+    scratch = join(tmp, "scratch.db")
+    copyfile(path, scratch)
+    app, display = bench_app(scratch)
+    # queries
+    record("db_get_tasks_list", lambda: len(app.db_get_tasks_list(False)))
+    record("db_get_tasks_list archives", lambda: len(app.db_get_tasks_list(True)))
+    record("db_get_tasks_list fts", lambda: len(app.db_get_tasks_list(False, "fix report")))
+    record("db_get_tasks_list like", lambda: len(app.db_get_tasks_list(False, "%fix report%")))
+    # listbox population
+    def load():
+        app.ui.lb.delete(0, "end")
+        app.ui_load_tasks_list(False)
+        app.ui.update_idletasks()
+        return(len(app.rows))
+    record("ui_load_tasks_list", load)
+    def reload():
+        id = app.tasks["0"]
+        app.db_set_task_property(id, "urgent", 1 - app.task_is_urgent(id))
+        total = app.ui_reload_tasks_list(False)
+        app.ui.update_idletasks()
+        return(total)
+    record("ui_reload_tasks_list one change", reload)
+    # toggles on a multi-selection
+    def toggle():
+        app.ui.lb.selection_clear(0, "end")
+        app.ui.lb.selection_set(0, min(SELECTION, len(app.rows)) - 1)
+        app.cb_toggle_task_done()
+        app.db_flush()
+        app.ui.update_idletasks()
+        return(len(app.ui.lb.curselection()))
+    record("cb_toggle_task_done selection", toggle, min(SELECTION, len(app.rows)))
+    # export / import
+    csv = join(tmp, "export.csv")
+    def export():
+        e = todo_core.csv_export(scratch, csv, app.db_get_tasks_queries(False))
+        e.run()
+        return(e.count)
+    record("export_tasks_list", export)
+    def load_csv():
+        target = join(tmp, "import.db")
+        if isfile(target):
+            remove(target)
+        core = todo_core.to_do_core(target)
+        with open(csv, 'r', newline='', encoding='utf-8') as f:
+            c, rejected = core.db_import_csv(f)
+        core.db_close()
+        return(c)
+    record("import_tasks_list", load_csv)
+    if display != "stand-in":
+        app.ui.destroy()
+    app.db_close()
+    return(display, results)
+
+def main(args=None):
+    "Build the databases and run the benchmarks"
+    parser = ArgumentParser(description=DOCHELP)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of tasks (default: %(default)s)")
+    parser.add_argument("--archived", type=float, default=ARCHIVED, help="fraction of archived tasks")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per operation")
+    parser.add_argument("--dir", default=".", help="where the 2do_bench_<size>.db files are kept")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the existing databases")
+    parser.add_argument("--output", help="write the JSON results in this file")
+    o = parser.parse_args(args)
+    report = {"program": "2do", "version": todo_core.VERSION, "python": python_version.split()[0],
+              "sqlite": sqlite_version, "archived": o.archived, "results": []}
+    tmp = mkdtemp(prefix="2do_bench_")
+    try:
+        for size in o.sizes:
+            path = join(o.dir, "2do_bench_{0}.db".format(size))
+            if o.rebuild or not isfile(path):
+                t, r = timed(lambda: gen_database(path, size, o.archived), 1)
+                print("{0:>8} {1:<32} {2:>10.4f}s".format(size, "generate", t), file=stderr)
+            report["display"], results = bench_size(path, size, o.repeat, tmp)
+            report["results"] += results
+    finally:
+        rmtree(tmp)
+    out = dumps(report, indent=1)
+    if o.output:
+        with open(o.output, 'w') as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ echo "Removing of 2do"
 echo "***************"
 
 sudo rm /usr/bin/2do.py
+sudo rm /usr/bin/todo_core.py
 sudo rm /usr/share/applications/2do.desktop
 
 echo "Remove done !"
@@ -0,0 +1,1459 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#---------------------------------------------------------------------
+# PARAM
+#---------------------------------------------------------------------
+
+# database file
+BASE = "test"
+PATH = "."
+SDBFILE = "{0}/2do_{1}.db".format(PATH, BASE)
+
+# workspaces: other databases opened in the same window (and searched
+# all together), e.g. ["{0}/2do_projet.db".format(PATH)]
+WORKSPACES = []
+ 
+# mode debug
+DEBUG = False
+
+# write-behind: number of queued statements forcing an immediate commit
+FLUSH_BATCH = 200
+
+# snapshot: the active tasks are kept in memory as columns, the list and
+# the searches are filtered without SQL (the writes are read back from
+# the change log)
+SNAPSHOT = False
+
+# bulk changes: tasks per statement (rowid IN (...))
+BULK_CHUNK = 500
+
+# csv export: rows fetched and written per chunk
+EXPORT_CHUNK = 1000
+
+# console: rows displayed per page of result, rows kept of a result (the
+# statement is closed at once, it must not lock the database between the
+# pages), statement timeout (s)
+CONSOLE_PAGE = 100
+CONSOLE_ROWS = 10000
+CONSOLE_TIMEOUT = 30
+
+# shared database (several instances): WAL journal and tuned pragmas
+SHARED = False
+
+# profiling: record the duration of the SQL statements, list reloads
+# and commits (rolling summary of the last PROFILE_SAMPLES)
+PROFILE = False
+PROFILE_FILE = "{0}/2do_{1}.prof.json".format(PATH, BASE)
+PROFILE_SAMPLES = 500
+
+#---------------------------------------------------------------------
+# PROGRAM
+#---------------------------------------------------------------------
+
+PROGRAM = "2do {}".format(BASE)
+VERSION = "v2.3"
+
+# core of 2do : the database, the workers and the command line, without
+# Tkinter (2do.py is the window), e.g. from todo_core import to_do_core
+
+
+#---------------------------------------------------------------------
+# SOURCE CODE
+#---------------------------------------------------------------------
+
+from sqlite3 import connect
+from sqlite3 import Connection
+from sqlite3 import Error as SqlError
+from os.path import isfile
+from os import remove
+from os.path import expanduser
+from os.path import basename
+from csv import reader as csv_reader
+from csv import writer as csv_writer
+from threading import Thread
+from threading import Event as ThreadEvent
+from threading import Lock
+from queue import Queue
+from urllib.parse import quote
+from time import time
+from time import perf_counter
+from collections import deque
+from collections import Counter
+from array import array
+from bisect import bisect_right
+from unicodedata import normalize
+from unicodedata import combining
+from re import compile as re_compile
+from re import escape as re_escape
+from re import DOTALL
+from json import dump as json_dump
+from datetime import datetime
+from argparse import ArgumentParser
+from sys import argv
+
+# SQL expression of the YYYYMMDD due date of a DD/MM/YYYY date
+DUE_SQL = "CASE WHEN {0} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]' THEN CAST(substr({0}, 7, 4) || substr({0}, 4, 2) || substr({0}, 1, 2) AS INT) END"
+
+# SQL expression of a new task id, unused in both the tasks and the archives tables
+NEW_ID_SQL = "(SELECT ifnull(max(id), 0) + 1 FROM (SELECT max(rowid) AS id FROM tasks UNION ALL SELECT max(rowid) FROM archives))"
+
+# SQL expression of the current time (UTC, milliseconds)
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# change log triggers ({0}: table, {1}: suffix, {2}: event, {3}: new/old, {4}: operation)
+CHANGES_TRIGGER = """CREATE TRIGGER {0}_log_{1} AFTER {2} ON {0} BEGIN
+            INSERT INTO changes (id, tbl, op, at) VALUES ({3}.rowid, '{0}', '{4}', """ + NOW_SQL + """);
+        END;"""
+CHANGES_EVENTS = [
+    ("ai", "INSERT", "new", "insert"),
+    ("au", "UPDATE OF task, milestone, active, done, urgent, team, date, updated", "new", "update"),
+    ("ad", "DELETE", "old", "delete"),
+]
+
+# live tasks counters by team/milestone ({0}: kind, {1}: new/old, {2}: 1/-1), urgent = urgent and not done
+COUNTS_UPSERT = """INSERT INTO counts (kind, name, tasks, done, urgent) VALUES ('{0}', ifnull({1}.{0}, ''), {2}, {2} * ({1}.done > 0), {2} * ({1}.urgent > 0 AND NOT {1}.done > 0))
+                ON CONFLICT (kind, name) DO UPDATE SET tasks = tasks + excluded.tasks, done = done + excluded.done, urgent = urgent + excluded.urgent;"""
+COUNTS_SEED = "INSERT INTO counts (kind, name, tasks, done, urgent) SELECT '{0}', ifnull({0}, ''), count(*), total(done > 0), total(urgent > 0 AND NOT done > 0) FROM tasks GROUP BY ifnull({0}, '');"
+
+# tasks list orders ({0} is the table prefix)
+ORDERS = {
+    "milestone": "{0}milestone, {0}task, {0}rowid",
+    "due": "{0}due IS NULL, {0}due, {0}milestone, {0}task, {0}rowid",
+}
+
+# pragmas of a shared database (readers don't wait for the writers)
+SHARED_PRAGMAS = [
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA cache_size = -16000;",
+    "PRAGMA mmap_size = 67108864;",
+    "PRAGMA busy_timeout = 5000;",
+]
+
+# schema migrations, applied in order on open (user_version = last applied)
+MIGRATIONS = [
+    # 1: covering index for the tasks list, indexes for team/milestone lookups
+    ["CREATE INDEX IF NOT EXISTS tasks_list ON tasks (active, milestone, task, done, urgent, team, date, updated);",
+     "CREATE INDEX IF NOT EXISTS tasks_team ON tasks (team, active);",
+     "CREATE INDEX IF NOT EXISTS tasks_milestone ON tasks (milestone, active);"],
+    # 2: due date as a sortable integer, kept up to date by triggers
+    ["ALTER TABLE tasks ADD COLUMN due INT;",
+     "UPDATE tasks SET due = {0};".format(DUE_SQL.format("date")),
+     """CREATE TRIGGER tasks_due_ai AFTER INSERT ON tasks BEGIN
+            UPDATE tasks SET due = {0} WHERE rowid = new.rowid;
+        END;""".format(DUE_SQL.format("new.date")),
+     """CREATE TRIGGER tasks_due_au AFTER UPDATE OF date ON tasks BEGIN
+            UPDATE tasks SET due = {0} WHERE rowid = new.rowid;
+        END;""".format(DUE_SQL.format("new.date")),
+     "DROP INDEX tasks_list;",
+     "CREATE INDEX tasks_list ON tasks (active, milestone, task, done, urgent, team, date, updated, due);",
+     "CREATE INDEX tasks_due ON tasks (active, due IS NULL, due, milestone, task);"],
+    # 3: archived tasks moved to their own table (same rowid), the tasks table keeps the live set
+    ["CREATE TABLE archives (task TEXT, milestone TEXT, active INT, done INT, urgent INT, team TEXT, date TEXT, updated TEXT, due INT);",
+     "INSERT INTO archives (rowid, task, milestone, active, done, urgent, team, date, updated, due) SELECT rowid, task, milestone, active, done, urgent, team, date, updated, due FROM tasks WHERE active = 0;",
+     "DELETE FROM tasks WHERE active = 0;",
+     """CREATE TRIGGER archives_due_ai AFTER INSERT ON archives BEGIN
+            UPDATE archives SET due = {0} WHERE rowid = new.rowid;
+        END;""".format(DUE_SQL.format("new.date")),
+     """CREATE TRIGGER archives_due_au AFTER UPDATE OF date ON archives BEGIN
+            UPDATE archives SET due = {0} WHERE rowid = new.rowid;
+        END;""".format(DUE_SQL.format("new.date")),
+     "CREATE INDEX archives_list ON archives (active, milestone, task, done, urgent, team, date, updated, due);",
+     "CREATE INDEX archives_due ON archives (active, due IS NULL, due, milestone, task);"],
+    # 4: change log of the tasks (monotonic seq, precise time) kept by triggers, seeded with the
+    #    existing tasks, and the cursors of the incremental exports
+    ["CREATE TABLE changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, id INT, tbl TEXT, op TEXT, at TEXT);",
+     "CREATE TABLE cursors (name TEXT PRIMARY KEY, seq INT);",
+     "INSERT INTO changes (id, tbl, op, at) SELECT rowid, 'tasks', 'insert', {0} FROM tasks;".format(NOW_SQL),
+     "INSERT INTO changes (id, tbl, op, at) SELECT rowid, 'archives', 'insert', {0} FROM archives;".format(NOW_SQL)] +
+    [CHANGES_TRIGGER.format(table, *event) for table in ("tasks", "archives") for event in CHANGES_EVENTS],
+    # 5: counters of the live tasks by team and by milestone, kept by triggers (the dashboards
+    #    read a row per team/milestone instead of counting the tasks)
+    ["CREATE TABLE counts (kind TEXT, name TEXT, tasks INT, done INT, urgent INT, PRIMARY KEY (kind, name)) WITHOUT ROWID;",
+     COUNTS_SEED.format("team"),
+     COUNTS_SEED.format("milestone"),
+     """CREATE TRIGGER tasks_counts_ai AFTER INSERT ON tasks BEGIN
+            {0}
+            {1}
+        END;""".format(COUNTS_UPSERT.format("team", "new", 1), COUNTS_UPSERT.format("milestone", "new", 1)),
+     """CREATE TRIGGER tasks_counts_ad AFTER DELETE ON tasks BEGIN
+            {0}
+            {1}
+        END;""".format(COUNTS_UPSERT.format("team", "old", -1), COUNTS_UPSERT.format("milestone", "old", -1)),
+     """CREATE TRIGGER tasks_counts_au AFTER UPDATE OF team, milestone, done, urgent ON tasks BEGIN
+            {0}
+            {1}
+            {2}
+            {3}
+        END;""".format(COUNTS_UPSERT.format("team", "old", -1), COUNTS_UPSERT.format("milestone", "old", -1),
+                       COUNTS_UPSERT.format("team", "new", 1), COUNTS_UPSERT.format("milestone", "new", 1))],
+]
+
+
+def debug(msgs):
+    if DEBUG:
+        print("[DEBUG]", msgs)
+
+def debug_sql(sql):
+    "Trace callback of the connections in debug mode (without the nested statements)"
+    if not sql.startswith("--"):
+        print("[SQL]", sql)
+
+def today():
+    now = datetime.now()
+    return(now.strftime("%d/%m/%Y"))
+
+def date_ordinal(date):
+    "Convert a DD/MM/YYYY date to a sortable YYYYMMDD integer (None if invalid)"
+    if not (date and len(date) == 10 and date[2] == '/' and date[5] == '/'):
+        return(None)
+    try:
+        return(int(date[6:10]) * 10000 + int(date[3:5]) * 100 + int(date[0:2]))
+    except ValueError:
+        return(None)
+
+def today_ordinal():
+    "Today as a sortable YYYYMMDD integer"
+    now = datetime.now()
+    return(now.year * 10000 + now.month * 100 + now.day)
+
+def db_execute_queries(db, queries):
+    "Execute the first query which succeeds, return the cursor"
+    for sql, params in queries[:-1]:
+        try:
+            return(db.execute(sql, params))
+        except SqlError as e:
+            if e.args and e.args[0] == "interrupted":
+                raise
+            debug(["Query failed, trying the next one", e])
+    sql, params = queries[-1]
+    return(db.execute(sql, params))
+
+def fts_query(mask):
+    "Convert a search string into a FTS5 query (every word as a prefix)"
+    words = mask.split()
+    return(" ".join('"{0}"*'.format(w.replace('"', '""')) for w in words))
+
+def workspace_name(dbfile):
+    "Short name of a database file (2do_<name>.db)"
+    name = basename(dbfile)
+    if name.startswith("2do_"):
+        name = name[4:]
+    if name.endswith(".db"):
+        name = name[:-3]
+    return(name)
+
+def fold(text):
+    "Lowercase a text and remove its accents (as the FTS5 tokenizer)"
+    text = text.lower()
+    if not text.isascii():
+        text = "".join(c for c in normalize("NFKD", text) if not combining(c))
+    return(text)
+
+def like_regex(mask):
+    "Convert a LIKE pattern into a regular expression (on a folded text)"
+    return(re_compile("".join(".*" if c == "%" else "." if c == "_" else re_escape(c) for c in fold(mask)), DOTALL))
+
+def chunks(l, n=BULK_CHUNK):
+    "Split a list in lists of n items"
+    return([l[i:i + n] for i in range(0, len(l), n)])
+
+def keyset_clause(after, prefix=""):
+    "SQL condition (and params) of the rows following the tasks row after, in milestone order"
+    if after is None:
+        return("", ())
+    id, task, milestone = after[0], after[1], after[2]
+    if milestone is None:
+        # NULL milestones come first and don't compare
+        return(" AND ({0}milestone IS NOT NULL OR ({0}task, {0}rowid) > (?, ?))".format(prefix), (task, id))
+    return(" AND ({0}milestone, {0}task, {0}rowid) > (?, ?, ?)".format(prefix), (milestone, task, id))
+    
+
+class task_record(object):
+
+    "A task loaded in memory"
+
+    __slots__ = ('id', 'task', 'milestone', 'active', 'done', 'urgent', 'team', 'date', 'updated', 'due')
+
+    def __init__(self, id, task, milestone, active, done, urgent, team, date, updated, due):
+        "Initialize the record from a tasks row"
+        self.id = id
+        self.task = task
+        self.milestone = milestone
+        self.active = int(active)
+        self.done = int(done)
+        self.urgent = int(urgent)
+        self.team = team
+        self.date = date
+        self.updated = updated
+        self.due = due
+
+
+class task_repository(object):
+
+    "Tasks records by rowid, kept coherent with the writes"
+
+    def __init__(self):
+        "Initialize the repository"
+        self.records = dict()
+
+    def get(self, id):
+        "Get the record of a task, None if not loaded"
+        return(self.records.get(id))
+
+    def load(self, rows):
+        "Replace the records with the loaded tasks rows"
+        self.records = dict((r[0], task_record(*r)) for r in rows)
+
+    def extend(self, rows):
+        "Add the records of more loaded tasks rows"
+        self.records.update((r[0], task_record(*r)) for r in rows)
+
+    def add(self, row):
+        "Add the record of a tasks row"
+        t = task_record(*row)
+        self.records[t.id] = t
+        return(t)
+
+    def set(self, id, tag, value):
+        "Set a property of a loaded task"
+        t = self.records.get(id)
+        if t is not None:
+            if tag in ('active', 'done', 'urgent'):
+                value = int(value)
+            elif tag == 'date':
+                t.due = date_ordinal(value)
+            setattr(t, tag, value)
+
+    def clear(self):
+        "Forget all the records"
+        self.records = dict()
+
+
+class task_snapshot(object):
+
+    "Active tasks held in memory as columns, filtered without SQL"
+
+    ALIVE = 1
+    DONE = 2
+    URGENT = 4
+
+    def __init__(self, db):
+        "Load the active tasks"
+        self.names = []
+        self.codes = dict()
+        self.load(db)
+
+    def load(self, db):
+        "Load (again) all the active tasks, in milestone order"
+        self.ids = array('q')
+        self.flags = array('B')
+        self.due = array('l')
+        self.team = array('H')
+        self.milestone = array('H')
+        self.tasks = []
+        self.dates = []
+        self.updated = []
+        self.texts = []
+        self.index = dict()
+        self.blob = None
+        self.offsets = None
+        self.dead = 0
+        self.ordered = True
+        self.matched = []
+        self.seq = db.execute("SELECT ifnull(max(seq), 0) FROM changes ;").fetchone()[0]
+        sql = "SELECT rowid, task, milestone, active, done, urgent, team, date, updated, due FROM tasks WHERE active = 1 ORDER BY {0} ;".format(ORDERS["milestone"].format(""))
+        for r in db.execute(sql):
+            self.add(r)
+
+    def intern(self, name):
+        "Code of a team/milestone name"
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return(code)
+
+    def add(self, r):
+        "Append a tasks row"
+        id, task, milestone, active, done, urgent, team, date, updated, due = r
+        self.index[id] = len(self.ids)
+        self.ids.append(id)
+        self.flags.append(self.ALIVE | (self.DONE if int(done) else 0) | (self.URGENT if int(urgent) else 0))
+        self.due.append(due or 0)
+        self.team.append(self.intern(team))
+        self.milestone.append(self.intern(milestone))
+        self.tasks.append(task)
+        self.dates.append(date)
+        self.updated.append(updated)
+        self.texts.append(fold("{0}\t{1}\t{2}\t{3}".format(task, team or "", milestone or "", date or "")))
+        self.blob = None
+
+    def refresh(self, db):
+        "Apply the changes logged since the load (one indexed lookup when nothing changed)"
+        seq = db.execute("SELECT ifnull(max(seq), 0) FROM changes ;").fetchone()[0]
+        if seq == self.seq:
+            return
+        oldest = db.execute("SELECT min(seq) FROM changes ;").fetchone()[0]
+        if self.seq < oldest - 1:
+            # the changes since the load were pruned
+            self.load(db)
+            return
+        ids = [r[0] for r in db.execute("SELECT DISTINCT id FROM changes WHERE seq > ? ;", (self.seq, ))]
+        self.seq = seq
+        for id in ids:
+            i = self.index.pop(id, None)
+            if i is not None:
+                self.flags[i] = 0
+                self.texts[i] = ""
+                self.dead += 1
+        if self.dead > len(self.ids) // 2:
+            self.load(db)
+            return
+        for chunk in chunks(ids):
+            sql = "SELECT rowid, task, milestone, active, done, urgent, team, date, updated, due FROM tasks WHERE active = 1 AND rowid IN ({0}) ;".format(", ".join("?" * len(chunk)))
+            for r in db.execute(sql, chunk):
+                self.add(r)
+                self.ordered = False
+        self.blob = None
+
+    def find(self, word, boundary=False):
+        "Indexes of the rows whose text contains word (at the start of a word)"
+        if self.blob is None:
+            self.blob = "\n".join(self.texts)
+            self.offsets = array('l', [0])
+            for t in self.texts:
+                self.offsets.append(self.offsets[-1] + len(t) + 1)
+        blob = self.blob
+        offsets = self.offsets
+        rows = set()
+        pos = blob.find(word)
+        while pos >= 0:
+            i = bisect_right(offsets, pos) - 1
+            if boundary and pos > 0 and blob[pos - 1].isalnum():
+                pos = blob.find(word, pos + 1)
+                continue
+            rows.add(i)
+            # next row
+            pos = blob.find(word, offsets[i + 1])
+        return(rows)
+
+    def match(self, mask="%"):
+        "Indexes of the alive rows matching a search (words : prefixes of words, else a LIKE pattern)"
+        flags = self.flags
+        if mask in ("", "%"):
+            return([i for i in range(len(flags)) if flags[i]])
+        if not mask.split():
+            # blanks only : a LIKE pattern, as the SQL search
+            mask = "%{0}%".format(mask)
+        if "%" in mask:
+            regex = like_regex(mask)
+            pieces = sorted((p for p in fold(mask).replace("_", "%").split("%") if p), key=len)
+            rows = self.find(pieces[-1]) if pieces else range(len(flags))
+            texts = self.texts
+            return(sorted(i for i in rows if flags[i] and any(regex.fullmatch(f) for f in texts[i].split("\t"))))
+        rows = None
+        for word in fold(mask).split():
+            found = self.find(word, True)
+            rows = found if rows is None else rows & found
+        return(sorted(i for i in rows if flags[i]))
+
+    def row(self, i):
+        "Get a row as a tasks row"
+        flags = self.flags[i]
+        return((self.ids[i], self.tasks[i], self.names[self.milestone[i]], 1, 1 if flags & self.DONE else 0,
+                1 if flags & self.URGENT else 0, self.names[self.team[i]], self.dates[i], self.updated[i], self.due[i] or None))
+
+    def get_rows(self, db, mask="%", order="milestone"):
+        "Get the tasks rows matching a search, in order (their indexes are kept in matched)"
+        self.refresh(db)
+        rows = self.matched = self.match(mask)
+        names = self.names
+        if order == "due":
+            due = self.due
+            rows.sort(key=lambda i: (not due[i], due[i], names[self.milestone[i]] is not None, names[self.milestone[i]] or "", self.tasks[i], self.ids[i]))
+        elif not self.ordered:
+            rows.sort(key=lambda i: (names[self.milestone[i]] is not None, names[self.milestone[i]] or "", self.tasks[i], self.ids[i]))
+        return([self.row(i) for i in rows])
+
+    def facets(self, rows=None):
+        "Count the rows (indexes, e.g. matched, default all) by team, by milestone, done and urgent"
+        if rows is None:
+            rows = self.match()
+        flags = self.flags
+        return({"team": Counter(self.names[self.team[i]] for i in rows),
+                "milestone": Counter(self.names[self.milestone[i]] for i in rows),
+                "done": sum(1 for i in rows if flags[i] & self.DONE),
+                "urgent": sum(1 for i in rows if flags[i] & self.URGENT)})
+
+
+class profiler(object):
+
+    "Rolling statistics of the SQL statements, reloads and commits"
+
+    def __init__(self, enabled=False, size=PROFILE_SAMPLES):
+        "Initialize the statistics"
+        self.enabled = enabled
+        self.samples = deque(maxlen=size)
+        self.totals = dict()
+        self.statements = dict()
+
+    def start(self):
+        "Start a measure, None when disabled"
+        if self.enabled:
+            return(perf_counter())
+
+    def stop(self, kind, start, rows=0):
+        "Record the measure started by start"
+        if start is not None:
+            self.record(kind, perf_counter() - start, rows)
+
+    def record(self, kind, seconds, rows=0, sql=None):
+        "Record a measure (count, duration, rows) of a kind, by statement for sql (rows : changed by the statement)"
+        self.samples.append((kind, seconds, rows))
+        t = self.totals.setdefault(kind, [0, 0.0, 0])
+        t[0] += 1
+        t[1] += seconds
+        t[2] += rows
+        if sql is not None:
+            s = self.statements.setdefault(sql, [0, 0.0, 0.0, 0])
+            s[0] += 1
+            s[1] += seconds
+            s[2] = max(s[2], seconds)
+            s[3] += rows
+
+    def summary(self):
+        "Summary of the last samples : count and mean duration by kind"
+        kinds = dict()
+        for kind, seconds, rows in list(self.samples):
+            k = kinds.setdefault(kind, [0, 0.0])
+            k[0] += 1
+            k[1] += seconds
+        l = ["{0} {1} x {2:.2f} ms".format(kind, n, 1000 * t / n) for kind, (n, t) in sorted(kinds.items())]
+        return(" | ".join(l))
+
+    def dump(self, fn):
+        "Save the statistics in a JSON file (the rows of the selects are in the query measures, not by statement)"
+        totals = dict((kind, {"count": n, "seconds": t, "rows": r}) for kind, (n, t, r) in self.totals.items())
+        statements = [{"sql": sql, "count": n, "seconds": t, "max": m, "changed": r}
+                      for sql, (n, t, m, r) in sorted(self.statements.items(), key=lambda s: -s[1][1])]
+        samples = [{"kind": kind, "seconds": t, "rows": r} for kind, t, r in self.samples]
+        with open(fn, 'w') as f:
+            json_dump({"totals": totals, "statements": statements, "samples": samples}, f, indent=1)
+
+prof = profiler(PROFILE)
+
+
+class profiled_connection(Connection):
+
+    "Connection recording its statements (for a select, the first step) and commits"
+
+    # rowcount : rows changed by a write, -1 for a select (recorded as 0)
+
+    def execute(self, sql, params=()):
+        "Execute a statement"
+        start = perf_counter()
+        cur = Connection.execute(self, sql, params)
+        prof.record("sql", perf_counter() - start, max(cur.rowcount, 0), sql)
+        return(cur)
+
+    def executemany(self, sql, params):
+        "Execute a statement for each parameters"
+        start = perf_counter()
+        cur = Connection.executemany(self, sql, params)
+        prof.record("sql", perf_counter() - start, max(cur.rowcount, 0), sql)
+        return(cur)
+
+    def commit(self):
+        "Commit the transaction"
+        start = perf_counter()
+        Connection.commit(self)
+        prof.record("commit", perf_counter() - start)
+
+
+class to_do_core(object):
+    "Class for the 2do database, without user interface"
+
+    def __init__(self, dbfile=SDBFILE):
+        "Open/create the database"
+        self.fts = False
+        self.pending = 0
+        self.repo = task_repository()
+        self.teams = None
+        self.snapshot = None
+        self.spaces = dict()
+        self.cross = None
+        self.cross_files = []
+        self.db = self.db_open_connection(dbfile)
+
+
+    ### DATABASE MANAGEMENT FUNCTIONS ###############################
+
+    def db_is_new(self, dbfile):
+        "Return True if the database doesn't exist"
+        if isfile(dbfile):
+            return(False)
+        else:
+            return(True)
+
+    def db_open_connection(self, dbfile=SDBFILE):
+        "Open the database if exists, else create a new database"
+        path = expanduser(dbfile)
+        debug([path])
+        self.dbfile = path
+        new = self.db_is_new(path)
+        db = connect(path, factory=profiled_connection if prof.enabled else Connection)
+        if DEBUG:
+            db.set_trace_callback(debug_sql)
+        if SHARED:
+            self.db_setup_pragmas(db)
+        if new and not self.db_create_tables(db):
+            return(None)
+        if not self.db_migrate(db):
+            return(None)
+        self.fts = self.db_setup_fts(db)
+        return(db)
+
+    def db_setup_pragmas(self, db):
+        "Set the pragmas of a shared database"
+        for sql in SHARED_PRAGMAS:
+            db.execute(sql)
+
+    def db_get_data_version(self):
+        "Get the data version (changed by the commits of the other connections)"
+        return(self.db.execute("PRAGMA data_version;").fetchone()[0])
+
+    def db_migrate(self, db):
+        "Apply the pending schema migrations"
+        version = db.execute("PRAGMA user_version;").fetchone()[0]
+        for i, migration in enumerate(MIGRATIONS[version:], version + 1):
+            debug(["Migrating the database to version {0}…".format(i)])
+            try:
+                db.execute("BEGIN;")
+                for sql in migration:
+                    debug([sql])
+                    db.execute(sql)
+                db.execute("PRAGMA user_version = {0};".format(i))
+                db.commit()
+            except SqlError as e:
+                db.rollback()
+                print("Migration {0} failed: {1}".format(i, e))
+                return(False)
+        if version < len(MIGRATIONS):
+            # refresh the planner statistics for the new indexes
+            db.execute("ANALYZE;")
+            db.commit()
+        return(True)
+
+    def db_has_fts(self, db):
+        "Return True if SQLite was built with FTS5"
+        try:
+            db.execute("CREATE VIRTUAL TABLE temp.fts_probe USING fts5(x);")
+            db.execute("DROP TABLE temp.fts_probe;")
+        except SqlError:
+            return(False)
+        return(True)
+
+    def db_setup_fts(self, db):
+        "Create/sync the full-text index of the tasks, return False if unavailable"
+        triggers = ("tasks_fts_ai", "tasks_fts_ad", "tasks_fts_au")
+        if not self.db_has_fts(db):
+            # without FTS5 the triggers would break every write on tasks
+            for trigger in triggers:
+                db.execute("DROP TRIGGER IF EXISTS {0};".format(trigger))
+            db.commit()
+            return(False)
+        sql = "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?, ?);"
+        if db.execute(sql, triggers).fetchone()[0] == len(triggers):
+            return(True)
+        debug(["Building the full-text index…"])
+        db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(task, team, milestone, date, content='tasks', content_rowid='rowid');")
+        db.execute("""CREATE TRIGGER IF NOT EXISTS tasks_fts_ai AFTER INSERT ON tasks BEGIN
+                          INSERT INTO tasks_fts(rowid, task, team, milestone, date) VALUES (new.rowid, new.task, new.team, new.milestone, new.date);
+                      END;""")
+        db.execute("""CREATE TRIGGER IF NOT EXISTS tasks_fts_ad AFTER DELETE ON tasks BEGIN
+                          INSERT INTO tasks_fts(tasks_fts, rowid, task, team, milestone, date) VALUES ('delete', old.rowid, old.task, old.team, old.milestone, old.date);
+                      END;""")
+        db.execute("""CREATE TRIGGER IF NOT EXISTS tasks_fts_au AFTER UPDATE OF task, team, milestone, date ON tasks BEGIN
+                          INSERT INTO tasks_fts(tasks_fts, rowid, task, team, milestone, date) VALUES ('delete', old.rowid, old.task, old.team, old.milestone, old.date);
+                          INSERT INTO tasks_fts(rowid, task, team, milestone, date) VALUES (new.rowid, new.task, new.team, new.milestone, new.date);
+                      END;""")
+        db.execute("INSERT INTO tasks_fts(tasks_fts) VALUES('rebuild');")
+        db.commit()
+        return(True)
+
+    def db_create_tables(self, db):
+        "Create the database's tables"
+        sql = "CREATE TABLE tasks (task TEXT, milestone TEXT, active INT, done INT, urgent INT, team TEXT, date TEXT, updated TEXT);"
+        debug([sql])
+        db.execute(sql)
+        db.commit()
+        sql = "CREATE TABLE milestones (lb TEXT PRIMARY KEY NOT NULL, fg TEXT DEFAULT ('#000000'), bg TEXT DEFAULT ('#FFFFFF'), active BOOLEAN DEFAULT (1));"
+        debug([sql])
+        db.execute(sql)
+        db.commit()
+        sql = "INSERT INTO milestones(lb) VALUES('milestone');"
+        debug([sql])
+        db.execute(sql)
+        db.commit()
+        sql = "CREATE TABLE teams (lb TEXT PRIMARY KEY NOT NULL, fg TEXT DEFAULT ('#000000'), bg TEXT DEFAULT ('#FFFFFF'), active BOOLEAN DEFAULT (1));"
+        debug([sql])
+        db.execute(sql)
+        db.commit()
+        for team in [("ANA","#000000","#F68383"),("CHF","#000000","#81DAF5"),("Q/R","#DF731B","#FFFFFF"),
+                  ("DEV","#000000","#D083F6"),("COR","#000000","#86F683"),("QAL","#000000","#F6B783"),
+                  ("RE7","#088A08","#FFFFFF"),("ARB","#1B7ADF","#FFFFFF"),("VAL","#A4A4A4","#FFFFFF"),
+                  ("N/A", "#000000","#FFFFFF")]:
+            sql = "INSERT INTO teams(lb, fg, bg) VALUES(?, ?, ?);"
+            db.execute(sql, team)
+        db.commit()
+        self.db = db
+        return(True)
+
+    def db_get_milestones(self):
+        "Get milestones"
+        sql = "SELECT lb, active FROM milestones WHERE active = 1 ORDER BY lb ;"
+        r = self.db.execute(sql)
+        return(r.fetchall())
+
+    def db_get_counts(self, kind):
+        "Get the live tasks counters by team or milestone {name: (tasks, done, urgent)}"
+        sql = "SELECT name, tasks, done, urgent FROM counts WHERE kind = ? AND tasks > 0 ;"
+        return(dict((name, (tasks, done, urgent)) for name, tasks, done, urgent in self.db.execute(sql, (kind, ))))
+
+    def db_get_teams(self):
+        "Get teams"
+        sql = "SELECT lb, fg, bg, active FROM teams WHERE active = 1 ORDER BY lb;"
+        r = self.db.execute(sql)
+        return(r.fetchall())
+        
+    def db_create_task(self, task, team):
+        "Add the task in the database"
+        sql = "INSERT INTO tasks (rowid, task, milestone, team, active, done, urgent, updated) VALUES ({0}, ?, '', ?, 1, 0, 0, ?);".format(NEW_ID_SQL)
+        id = self.db_write(sql, (task, team, today())).lastrowid
+        return(id)
+
+    def db_set_task_property(self, id, tag, value):
+        "Set task property"
+        update_date = False
+        if tag == "milestone":
+            sql = "UPDATE {0} SET milestone = ? WHERE rowid = ? ;"
+        elif tag == "team":
+            sql = "UPDATE {0} SET team = ? WHERE rowid = ? ;"
+            update_date = True
+        elif tag == "active":
+            self.db_move_task(id, value)
+            self.repo.set(id, tag, value)
+            return(True)
+        elif tag == "done":
+            sql = "UPDATE {0} SET done = ? WHERE rowid = ? ;"
+            update_date = True
+        elif tag == "urgent":
+            sql = "UPDATE {0} SET urgent = ? WHERE rowid = ? ;"
+        elif tag == "task":
+            sql = "UPDATE {0} SET task = ? WHERE rowid = ? ;"
+        elif tag == "date":
+            sql = "UPDATE {0} SET date = ? WHERE rowid = ? ;"
+        else:
+            return(False)
+        self.db_update_task(sql, (value, id))
+        self.repo.set(id, tag, value)
+        if update_date:
+            sql = "UPDATE {0} SET updated = ? WHERE rowid = ? ;"
+            self.db_update_task(sql, (today(), id))
+            self.repo.set(id, "updated", today())
+        return(True)
+
+    def db_update_task(self, sql, params):
+        "Update a task ({0} : table) in the tasks table, else in the archives"
+        if self.db_write(sql.format("tasks"), params).rowcount == 0:
+            self.db_write(sql.format("archives"), params)
+
+    def db_move_task(self, id, active):
+        "Move a task to the tasks (active) or archives table, in the current transaction"
+        src, dst = ("archives", "tasks") if int(active) else ("tasks", "archives")
+        # the id is kept, unless another task took it
+        sql = "INSERT INTO {1} (rowid, task, milestone, active, done, urgent, team, date, updated, due) SELECT CASE WHEN EXISTS (SELECT 1 FROM {1} WHERE rowid = ?) THEN {2} ELSE rowid END, task, milestone, ?, done, urgent, team, date, updated, due FROM {0} WHERE rowid = ? ;".format(src, dst, NEW_ID_SQL)
+        self.db.execute(sql, (id, int(active), id))
+        # only the delete counts as a write : a flush can't split the move
+        self.db_write("DELETE FROM {0} WHERE rowid = ? ;".format(src), (id, ))
+
+    def db_write(self, sql, params=()):
+        "Execute a write now, its commit is grouped with the next ones"
+        cur = self.db.execute(sql, params)
+        self.pending += 1
+        if self.pending >= FLUSH_BATCH:
+            self.db_flush()
+        else:
+            self.db_schedule_flush()
+        return(cur)
+
+    def db_schedule_flush(self):
+        "Called after a write : the commit waits for db_flush (or FLUSH_BATCH writes)"
+        pass
+
+    def db_flush(self):
+        "Commit the pending writes in one transaction"
+        if self.pending:
+            debug(["COMMIT", self.pending])
+            self.db.commit()
+            self.pending = 0
+
+    def db_close(self):
+        "Commit the pending writes and close the databases"
+        self.db.commit()
+        self.pending = 0
+        self.db.close()
+        for db, fts, repo, teams, snapshot in self.spaces.values():
+            db.commit()
+            db.close()
+        self.spaces.clear()
+        if self.cross is not None:
+            self.cross.close()
+            self.cross = None
+
+    def db_use_workspace(self, dbfile):
+        "Switch to another database, opened once then kept open with its state (False if not possible)"
+        path = expanduser(dbfile)
+        if path == self.dbfile:
+            return(True)
+        self.db_flush()
+        if self.pending:
+            # not committed (locked) : the writes must stay with their connection
+            return(False)
+        current = (self.dbfile, (self.db, self.fts, self.repo, self.teams, self.snapshot))
+        if path in self.spaces:
+            self.db, self.fts, self.repo, self.teams, self.snapshot = self.spaces.pop(path)
+            self.dbfile = path
+        else:
+            self.repo = task_repository()
+            self.teams = None
+            self.snapshot = None
+            db = self.db_open_connection(path)
+            if db is None:
+                self.dbfile, (self.db, self.fts, self.repo, self.teams, self.snapshot) = current
+                return(False)
+            self.db = db
+        self.spaces[current[0]] = current[1]
+        return(True)
+
+    def db_set_tasks_property(self, ids, tag, value):
+        "Set a property of several tasks, one statement by BULK_CHUNK tasks"
+        if tag == "active":
+            return(self.db_move_tasks(ids, value))
+        if tag not in ("milestone", "team", "done", "urgent", "task", "date"):
+            return(False)
+        if tag in ("team", "done"):
+            sql = "UPDATE {{0}} SET {0} = ?, updated = ? WHERE rowid IN ({{1}}) ;".format(tag)
+            params = (value, today())
+        else:
+            sql = "UPDATE {{0}} SET {0} = ? WHERE rowid IN ({{1}}) ;".format(tag)
+            params = (value, )
+        self.db_update_tasks(sql, params, ids)
+        for id in ids:
+            self.repo.set(id, tag, value)
+            if tag in ("team", "done"):
+                self.repo.set(id, "updated", today())
+        return(True)
+
+    def db_toggle_tasks_flag(self, ids, tag):
+        "Toggle the done/urgent flag of several tasks, one statement by BULK_CHUNK tasks"
+        if tag == "done":
+            sql = "UPDATE {0} SET done = CASE WHEN done > 0 THEN 0 ELSE 1 END, updated = ? WHERE rowid IN ({1}) ;"
+            params = (today(), )
+        elif tag == "urgent":
+            sql = "UPDATE {0} SET urgent = CASE WHEN urgent > 0 THEN 0 ELSE 1 END WHERE rowid IN ({1}) ;"
+            params = ()
+        else:
+            return(False)
+        self.db_update_tasks(sql, params, ids)
+        for id in ids:
+            t = self.repo.get(id)
+            if t is not None:
+                self.repo.set(id, tag, 0 if getattr(t, tag) else 1)
+                if tag == "done":
+                    self.repo.set(id, "updated", today())
+        return(True)
+
+    def db_update_tasks(self, sql, params, ids):
+        "Update tasks ({0} : table, {1} : rowids) in the tasks table, the missing ones in the archives"
+        for chunk in chunks(ids):
+            marks = ", ".join("?" * len(chunk))
+            if self.db_write(sql.format("tasks", marks), params + tuple(chunk)).rowcount < len(chunk):
+                self.db_write(sql.format("archives", marks), params + tuple(chunk))
+
+    def db_move_tasks(self, ids, active):
+        "Move several tasks to the tasks (active) or archives table"
+        src, dst = ("archives", "tasks") if int(active) else ("tasks", "archives")
+        cols = "task, milestone, active, done, urgent, team, date, updated, due"
+        for chunk in chunks(ids):
+            marks = ", ".join("?" * len(chunk))
+            # the tasks whose id was taken by another task get a new id, one by one
+            sql = "SELECT rowid FROM {0} WHERE rowid IN ({1}) ;".format(dst, marks)
+            taken = set(r[0] for r in self.db.execute(sql, chunk))
+            for id in taken:
+                self.db_move_task(id, active)
+            chunk = [id for id in chunk if id not in taken]
+            if chunk:
+                marks = ", ".join("?" * len(chunk))
+                sql = "INSERT INTO {1} (rowid, {2}) SELECT rowid, {3} FROM {0} WHERE rowid IN ({4}) ;".format(src, dst, cols, cols.replace("active", "?"), marks)
+                self.db.execute(sql, [int(active)] + chunk)
+                # only the delete counts as a write : a flush can't split the move
+                self.db_write("DELETE FROM {0} WHERE rowid IN ({1}) ;".format(src, marks), chunk)
+        for id in ids:
+            self.repo.set(id, "active", active)
+        return(True)
+
+    def db_search_workspaces(self, dbfiles, mask="%", archives=False):
+        "Search the tasks of several databases in one query, rows are (source, rowid, task, ...)"
+        dbfiles = [expanduser(f) for f in dbfiles if isfile(expanduser(f))]
+        # every database is opened once (created/migrated) before being attached
+        current = self.dbfile
+        for f in dbfiles:
+            self.db_use_workspace(f)
+        self.db_use_workspace(current)
+        self.db_flush()
+        if self.cross is None or self.cross_files != dbfiles:
+            if self.cross is not None:
+                self.cross.close()
+            self.cross = connect(":memory:")
+            for i, f in enumerate(dbfiles):
+                self.cross.execute("ATTACH DATABASE ? AS ? ;", (f, "ws{0}".format(i)))
+            self.cross_files = dbfiles
+        table = "archives" if archives else "tasks"
+        cols = "rowid, task, milestone, active, done, urgent, team, date, updated, due"
+        if "%" not in mask:
+            mask = "%{0}%".format(mask)
+        selects = []
+        params = []
+        for i, f in enumerate(dbfiles):
+            selects.append("SELECT ? AS source, {0} FROM ws{1}.{2} WHERE task LIKE ? OR team LIKE ? OR milestone LIKE ? OR date LIKE ?".format(cols, i, table))
+            params += [workspace_name(f), mask, mask, mask, mask]
+        if not selects:
+            return([])
+        sql = "{0} ORDER BY source, milestone, task, rowid ;".format(" UNION ALL ".join(selects))
+        return(self.cross.execute(sql, params).fetchall())
+
+    def db_get_tasks_queries(self, archives, mask="%", order="milestone", after=None, limit=None):
+        "Get the queries (sql, params) of the tasks list (or of a page after a row), the next ones are fallbacks"
+        active = 0 if archives else 1
+        table = "archives" if archives else "tasks"
+        cols = "rowid, task, milestone, active, done, urgent, team, date, updated, due"
+        page = ""
+        keys = ()
+        if limit:
+            # keyset pagination : pages follow the milestone order
+            order = "milestone"
+            page = " LIMIT ?"
+            keys = (limit, )
+        if mask in ("", "%"):
+            where, params = keyset_clause(after)
+            sql = "SELECT {0} FROM {1} WHERE active = ?{2} ORDER BY {3}{4} ;".format(cols, table, where, ORDERS[order].format(""), page)
+            return([(sql, (active, ) + params + keys)])
+        queries = []
+        if self.fts and not archives and "%" not in mask:
+            # full-text search (live tasks), best matches first (except for the pages)
+            where, params = keyset_clause(after, "t.")
+            rank = "" if limit else "tasks_fts.rank, "
+            sql = "SELECT t.{0} FROM tasks_fts JOIN tasks t ON t.rowid = tasks_fts.rowid WHERE tasks_fts MATCH ? AND t.active = ?{1} ORDER BY {2}{3}{4} ;".format(cols.replace(", ", ", t."), where, rank, ORDERS[order].format("t."), page)
+            queries.append((sql, (fts_query(mask), active) + params + keys))
+        if "%" not in mask:
+            mask = "%{0}%".format(mask)
+        where, params = keyset_clause(after)
+        sql = "SELECT {0} FROM {1} WHERE active = ? AND (task LIKE ? OR team LIKE ? OR milestone LIKE ? OR date LIKE ?){2} ORDER BY {3}{4} ;".format(cols, table, where, ORDERS[order].format(""), page)
+        queries.append((sql, (active, mask, mask, mask, mask) + params + keys))
+        return(queries)
+
+    def db_get_tasks_list(self, archives, mask="%", order="milestone", after=None, limit=None):
+        "Get the tasks list (or a page of limit tasks after the row after)"
+        if SNAPSHOT and not archives and not limit:
+            if self.snapshot is None:
+                self.snapshot = task_snapshot(self.db)
+            return(self.snapshot.get_rows(self.db, mask, order))
+        return(db_execute_queries(self.db, self.db_get_tasks_queries(archives, mask, order, after, limit)).fetchall())
+
+    def db_get_cursor(self, name):
+        "Get the last change exported by an incremental export"
+        r = self.db.execute("SELECT seq FROM cursors WHERE name = ? ;", (name, )).fetchone()
+        return(r[0] if r else 0)
+
+    def db_set_cursor(self, name, seq):
+        "Set the last change exported by an incremental export, prune the changes exported by all the cursors"
+        self.db_write("INSERT OR REPLACE INTO cursors (name, seq) VALUES (?, ?) ;", (name, seq))
+        self.db_prune_changes()
+
+    def db_prune_changes(self):
+        "Delete the changes up to the lowest cursor (the last change is kept), return the number deleted"
+        sql = "DELETE FROM changes WHERE seq <= (SELECT min(seq) FROM cursors) AND seq < (SELECT max(seq) FROM changes) ;"
+        return(self.db_write(sql).rowcount)
+
+    def db_export_changes(self, f, since=0):
+        "Write the tasks changed after the change since as CSV (last state or deletion), return (count, last change)"
+        sql = """SELECT c.id, max(c.seq), max(c.at),
+                        t.rowid, t.task, t.milestone, t.active, t.done, t.urgent, t.team, t.date, t.updated,
+                        a.rowid, a.task, a.milestone, a.active, a.done, a.urgent, a.team, a.date, a.updated
+                   FROM changes c LEFT JOIN tasks t ON t.rowid = c.id LEFT JOIN archives a ON a.rowid = c.id
+                  WHERE c.seq > ? GROUP BY c.id ORDER BY 2 ;"""
+        self.db_flush()
+        # the log is pruned from its start : it holds every change after oldest - 1
+        oldest = self.db.execute("SELECT min(seq) FROM changes ;").fetchone()[0]
+        if oldest is not None and since < oldest - 1:
+            raise ValueError("the changes up to {0} were pruned, start from a copy of the database with --since {0}".format(oldest - 1))
+        w = csv_writer(f, delimiter=';')
+        w.writerow(["seq", "op", "id", "task", "milestone", "active", "done", "urgent", "team", "date", "updated", "at"])
+        count = 0
+        last = since
+        for r in self.db.execute(sql, (since, )):
+            id, last, at = r[0:3]
+            row = r[4:12] if r[3] is not None else r[13:21] if r[12] is not None else None
+            if row is None:
+                w.writerow([last, "delete", id] + [""] * 8 + [at])
+            else:
+                w.writerow([last, "set", id] + list(row) + [at])
+            count += 1
+        return(count, last)
+
+    def db_apply_changes(self, f):
+        "Apply the changes written by db_export_changes in one transaction, return the number of changes"
+        self.db_flush()
+        sql = "INSERT INTO {0} (rowid, task, milestone, active, done, urgent, team, date, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ;"
+        count = 0
+        with self.db:
+            for l in csv_reader(f, delimiter=';'):
+                if not l or l[0] == 'seq':
+                    continue
+                id = int(l[2])
+                self.db.execute("DELETE FROM tasks WHERE rowid = ? ;", (id, ))
+                self.db.execute("DELETE FROM archives WHERE rowid = ? ;", (id, ))
+                if l[1] == "set":
+                    v = [None if x in ('', 'None') else x for x in l[3:11]]
+                    v[1] = v[1] or ''
+                    self.db.execute(sql.format("tasks" if int(v[2]) else "archives"), [id] + v)
+                count += 1
+        self.repo.clear()
+        return(count)
+
+    def db_import_csv(self, f):
+        "Insert the tasks of an exported CSV file in one transaction, return (imported, rejected)"
+        rejected = []
+        def rows():
+            for n, l in enumerate(csv_reader(f, delimiter=';'), 1):
+                # id;task;milestone;active;done;urgent;team;date[;updated]
+                if not l or l[0] == 'id':
+                    continue
+                if len(l) not in (8, 9) or not l[1] or \
+                   l[4] not in ('0', '1') or l[5] not in ('0', '1'):
+                    rejected.append(n)
+                    continue
+                l = [None if v in ('', 'None') else v for v in l]
+                updated = l[8] if len(l) == 9 and l[8] else today()
+                yield (l[1], l[2] or '', int(l[4]), int(l[5]), l[6], l[7], updated)
+        self.db_flush()
+        sql = "INSERT INTO tasks (rowid, task, milestone, active, done, urgent, team, date, updated) VALUES ({0}, ?, ?, 1, ?, ?, ?, ?, ?);".format(NEW_ID_SQL)
+        with self.db:
+            c = self.db.executemany(sql, rows()).rowcount
+        if rejected:
+            debug(["Rejected lines", rejected])
+        return(c, len(rejected))
+
+    def task_create_task_from_task(self, id):
+        "Create a task duplicating an existing task"
+        task = self.task_get_task_details(id)
+        sql = "INSERT INTO tasks (rowid, task, milestone, team, active, done, urgent, updated) VALUES ({0}, ?, ?, ?, 1, 0, 0, ?);".format(NEW_ID_SQL)
+        new = self.db_write(sql, (task.task, task.milestone, task.team, today())).lastrowid
+        return(new)
+
+    def task_create_tasks_from_tasks(self, ids):
+        "Create tasks duplicating existing tasks, return the new ids (in the order of the rowids)"
+        new = []
+        for chunk in chunks(ids):
+            first = self.db.execute("SELECT {0} ;".format(NEW_ID_SQL)).fetchone()[0]
+            marks = ", ".join("?" * len(chunk))
+            # the archived tasks are duplicated as live tasks
+            sql = "INSERT INTO tasks (rowid, task, milestone, team, active, done, urgent, updated) SELECT ? - 1 + row_number() OVER (ORDER BY id), task, milestone, team, 1, 0, 0, ? FROM (SELECT rowid AS id, task, milestone, team FROM tasks WHERE rowid IN ({0}) UNION ALL SELECT rowid, task, milestone, team FROM archives WHERE rowid IN ({0})) ;".format(marks)
+            n = self.db_write(sql, [first, today()] + list(chunk) * 2).rowcount
+            new += range(first, first + n)
+        return(new)
+
+    def task_get_task_details(self, id):
+        "Get task's details (from memory if loaded)"
+        t = self.repo.get(id)
+        if t is not None:
+            return(t)
+        sql = "SELECT rowid, task, milestone, active, done, urgent, team, date, updated, due FROM tasks WHERE rowid = ? UNION ALL SELECT rowid, task, milestone, active, done, urgent, team, date, updated, due FROM archives WHERE rowid = ? ;"
+        r = self.db.execute(sql, (id, id)).fetchone()
+        if r:
+            return(self.repo.add(r))
+
+
+
+    ### FUNCTIONS ###################################################
+
+    def task_get_task(self, id):
+        "Get a task"
+        t = self.task_get_task_details(id)
+        return(t.task)
+
+    def task_get_date(self, id):
+        "Get task's due date"
+        t = self.task_get_task_details(id)
+        return(t.date)
+
+    def task_get_updated(self, id):
+        "Get task's update date"
+        t = self.task_get_task_details(id)
+        return(t.updated)
+
+    def task_is_urgent(self, id):
+        "Get urgent flag for the task"
+        t = self.task_get_task_details(id)
+        return(t.urgent)
+
+    def task_is_done(self, id):
+        "Get done flag for the task"
+        t = self.task_get_task_details(id)
+        return(t.done)
+
+    def task_is_archived(self, id):
+        "Get the *active* flag for the task"
+        t = self.task_get_task_details(id)
+        return(t.active)
+
+    def get_teams(self):
+        "Get teams param (read once, until clear_teams)"
+        if self.teams is None:
+            self.teams = dict((lb, (fg, bg)) for lb, fg, bg, act in self.db_get_teams())
+        return(self.teams)
+
+    def clear_teams(self):
+        "Forget the teams param, read again on next use"
+        self.teams = None
+
+
+class csv_export(Thread):
+
+    "Export of a tasks query as CSV, in a thread with its own connection"
+
+    def __init__(self, dbfile, fn, queries):
+        "Initialize the export"
+        Thread.__init__(self, daemon=True)
+        self.dbfile = dbfile
+        self.fn = fn
+        self.queries = queries
+        self.count = 0
+        self.started = time()
+        self.error = None
+        self.done = False
+        self.cancelled = ThreadEvent()
+
+    def run(self):
+        "Stream the rows into the file"
+        db = connect(self.dbfile)
+        try:
+            with open(self.fn, 'w', newline='', encoding='utf-8') as f:
+                w = csv_writer(f, delimiter=';')
+                w.writerow(["id", "task", "milestone", "active", "done", "urgent", "team", "date", "updated"])
+                cur = db_execute_queries(db, self.queries)
+                while not self.cancelled.is_set():
+                    rows = cur.fetchmany(EXPORT_CHUNK)
+                    if not rows:
+                        break
+                    w.writerows(r[:9] for r in rows)
+                    self.count += len(rows)
+            if self.cancelled.is_set():
+                remove(self.fn)
+        except (SqlError, OSError) as e:
+            self.error = e
+        finally:
+            db.close()
+            self.done = True
+
+
+class search_worker(Thread):
+
+    "Thread running the searches on its own connection, only the latest one counts"
+
+    def __init__(self, dbfile):
+        "Initialize the worker"
+        Thread.__init__(self, daemon=True)
+        self.dbfile = dbfile
+        self.db = None
+        self.lock = Lock()
+        self.wakeup = ThreadEvent()
+        self.request = None
+        self.busy = False
+        self.results = Queue()
+
+    def submit(self, seq, queries):
+        "Queue a search, interrupting the one in progress"
+        with self.lock:
+            self.request = (seq, queries)
+            if self.busy:
+                self.db.interrupt()
+        self.wakeup.set()
+
+    def stop(self):
+        "Stop the worker"
+        self.submit(None, None)
+
+    def run(self):
+        "Run the searches"
+        self.db = connect(self.dbfile)
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                self.wakeup.clear()
+                seq, queries = self.request
+                self.busy = True
+            if queries is None:
+                break
+            try:
+                l = db_execute_queries(self.db, queries).fetchall()
+            except SqlError as e:
+                debug(["Search", seq, e])
+                l = None
+            with self.lock:
+                self.busy = False
+            self.results.put((seq, l))
+        self.db.close()
+
+
+class console_worker(Thread):
+
+    "Thread executing the console requests on its own connection"
+
+    def __init__(self, dbfile, readonly=False):
+        "Initialize the worker"
+        Thread.__init__(self, daemon=True)
+        self.dbfile = dbfile
+        self.readonly = readonly
+        self.db = None
+        self.requests = Queue()
+        self.results = Queue()
+        self.cancelled = ThreadEvent()
+        self.deadline = 0
+
+    def execute(self, sql):
+        "Queue a request"
+        self.cancelled.clear()
+        self.requests.put(("execute", sql))
+
+    def fetch(self):
+        "Queue the fetch of the next page"
+        self.cancelled.clear()
+        self.requests.put(("fetch", None))
+
+    def cancel(self):
+        "Cancel the running request"
+        self.cancelled.set()
+        if self.db:
+            self.db.interrupt()
+
+    def stop(self):
+        "Stop the worker"
+        self.cancel()
+        self.requests.put((None, None))
+
+    def progress(self):
+        "SQLite progress handler : abort when cancelled or too long"
+        return(self.cancelled.is_set() or time() > self.deadline)
+
+    def run(self):
+        "Execute the requests"
+        try:
+            if self.readonly:
+                self.db = connect("file:{0}?mode=ro".format(quote(self.dbfile)), uri=True)
+            else:
+                self.db = connect(self.dbfile)
+        except SqlError as e:
+            self.results.put(("error", "{0}".format(e.args[0]), 0))
+            return
+        self.db.set_progress_handler(self.progress, 10000)
+        buffer = []
+        while True:
+            op, sql = self.requests.get()
+            if op is None:
+                break
+            started = time()
+            self.deadline = started + CONSOLE_TIMEOUT
+            try:
+                if op == "execute":
+                    buffer = []
+                    c = self.db.execute(sql)
+                    if not c.description:
+                        self.db.commit()
+                        self.results.put(("done", c.rowcount, time() - started))
+                        continue
+                    # read the rows now : an open statement would keep its read lock
+                    buffer = c.fetchmany(CONSOLE_ROWS)
+                    c.close()
+                    self.db.commit()
+                    buffer.reverse()
+                rows = [buffer.pop() for i in range(min(CONSOLE_PAGE, len(buffer)))]
+                self.results.put(("rows", rows, time() - started))
+            except SqlError as e:
+                buffer = []
+                self.db.rollback()
+                if self.cancelled.is_set():
+                    msg = "Cancelled."
+                elif e.args and e.args[0] == "interrupted":
+                    msg = "Timeout after {0}s.".format(CONSOLE_TIMEOUT)
+                else:
+                    msg = "{0}".format(e.args[0])
+                self.results.put(("error", msg, time() - started))
+        self.db.close()
+
+
+#---------------------------------------------------------------------
+# COMMAND LINE
+#---------------------------------------------------------------------
+
+def cli_main(args):
+    "Command line interface (never imports Tkinter)"
+    parser = ArgumentParser(description="{0} {1} - command line (2do.py without arguments opens the window).".format(PROGRAM, VERSION))
+    parser.add_argument("--db", default=SDBFILE, help="database file (default: %(default)s)")
+    parser.add_argument("--profile", metavar="FILE", help="save the statements timings in FILE")
+    sub = parser.add_subparsers(dest="cmd", metavar="command")
+    sub.required = True
+    p = sub.add_parser("add", help="add a task")
+    p.add_argument("task")
+    p.add_argument("-t", "--team")
+    p.add_argument("-m", "--milestone")
+    p.add_argument("-d", "--date", help="due date (DD/MM/YYYY)")
+    p = sub.add_parser("list", help="list the tasks")
+    p.add_argument("mask", nargs="?", default="%", help="search (words or %%pattern%%)")
+    p.add_argument("-a", "--archives", action="store_true", help="list the archived tasks")
+    p.add_argument("--due", action="store_true", help="sort by due date")
+    for cmd in ("done", "urgent"):
+        p = sub.add_parser(cmd, help="set the {0} flag of tasks".format(cmd))
+        p.add_argument("ids", nargs="+", type=int)
+        p.add_argument("-u", "--unset", action="store_true", help="unset the flag")
+    p = sub.add_parser("export", help="export the tasks as CSV")
+    p.add_argument("file")
+    p.add_argument("mask", nargs="?", default="%")
+    p.add_argument("-a", "--archives", action="store_true")
+    p = sub.add_parser("import", help="import a CSV file")
+    p.add_argument("file")
+    p = sub.add_parser("changes", help="export the tasks changed since the last export (CSV)")
+    p.add_argument("file")
+    p.add_argument("--cursor", default="export", help="name of the stored position (default: %(default)s)")
+    p.add_argument("--since", type=int, help="export from this change (the cursor is not moved)")
+    p = sub.add_parser("apply", help="apply the changes exported by 'changes'")
+    p.add_argument("file")
+    p = sub.add_parser("counts", help="count the live tasks by team and milestone")
+    p = sub.add_parser("find", help="search the tasks of several databases")
+    p.add_argument("mask", nargs="?", default="%", help="search (words or %%pattern%%)")
+    p.add_argument("-a", "--archives", action="store_true", help="search the archived tasks")
+    p.add_argument("--in", dest="dbfiles", nargs="+", metavar="FILE", help="databases (default: --db and WORKSPACES)")
+    o = parser.parse_args(args)
+    prof.enabled = prof.enabled or bool(o.profile)
+    core = to_do_core(o.db)
+    if not core.db:
+        print("Database error !")
+        return(1)
+    try:
+        return(CLI_COMMANDS[o.cmd](core, o))
+    except (SqlError, OSError, ValueError) as e:
+        print("Error : {0}".format(e))
+        return(1)
+    finally:
+        core.db_close()
+        if o.profile:
+            prof.dump(o.profile)
+
+def cli_add(core, o):
+    "Command add"
+    id = core.db_create_task(o.task, o.team)
+    if o.milestone:
+        core.db_set_task_property(id, "milestone", o.milestone)
+    if o.date:
+        core.db_set_task_property(id, "date", o.date)
+    print("Task {0} added !".format(id))
+    return(0)
+
+def cli_list(core, o):
+    "Command list"
+    now = today_ordinal()
+    l = core.db_get_tasks_list(o.archives, o.mask, "due" if o.due else "milestone")
+    for id, task, milestone, active, done, urgent, team, date, updated, due in l:
+        flags = "D" if int(done) else "U" if int(urgent) else "!" if due and due <= now else " "
+        print("{0:>6} {1} {2}|{3}|{4}|{5}".format(id, flags, str(milestone).ljust(8), str(date or '----------').ljust(10), str(team or '').ljust(3), task))
+    return(0)
+
+def cli_set_flag(core, o):
+    "Commands done/urgent"
+    for id in o.ids:
+        if core.task_get_task_details(id) is None:
+            print("Task {0} not found !".format(id))
+            continue
+        core.db_set_task_property(id, o.cmd, 0 if o.unset else 1)
+        print("Task {0} {1}{2} !".format(id, "not " if o.unset else "", o.cmd))
+    return(0)
+
+def cli_export(core, o):
+    "Command export"
+    core.db_flush()
+    export = csv_export(core.dbfile, o.file, core.db_get_tasks_queries(o.archives, o.mask))
+    export.run()
+    if export.error:
+        print("Export failed : {0}".format(export.error))
+        return(1)
+    print("{0} tasks exported".format(export.count))
+    return(0)
+
+def cli_import(core, o):
+    "Command import"
+    with open(o.file, 'r', newline='', encoding='utf-8') as f:
+        c, rejected = core.db_import_csv(f)
+    print("{0} task(s) imported, {1} line(s) rejected".format(c, rejected))
+    return(0)
+
+def cli_changes(core, o):
+    "Command changes"
+    since = o.since if o.since is not None else core.db_get_cursor(o.cursor)
+    with open(o.file, 'w', newline='', encoding='utf-8') as f:
+        c, last = core.db_export_changes(f, since)
+    if o.since is None:
+        core.db_set_cursor(o.cursor, last)
+    print("{0} change(s) exported, from {1} to {2}".format(c, since, last))
+    return(0)
+
+def cli_apply(core, o):
+    "Command apply"
+    with open(o.file, 'r', newline='', encoding='utf-8') as f:
+        c = core.db_apply_changes(f)
+    print("{0} change(s) applied".format(c))
+    return(0)
+
+def cli_find(core, o):
+    "Command find"
+    l = core.db_search_workspaces(o.dbfiles or [core.dbfile] + WORKSPACES, o.mask, o.archives)
+    for source, id, task, milestone, active, done, urgent, team, date, updated, due in l:
+        print("{0} {1:>6} {2}|{3}|{4}|{5}".format(source.ljust(10), id, str(milestone).ljust(8), str(date or '----------').ljust(10), str(team or '').ljust(3), task))
+    return(0)
+
+def cli_counts(core, o):
+    "Command counts"
+    for kind in ("team", "milestone"):
+        print("{0} {1:>6} {2:>6} {3:>6}".format(kind.ljust(10), "open", "done", "urgent"))
+        for name, (tasks, done, urgent) in sorted(core.db_get_counts(kind).items()):
+            print("{0} {1:>6} {2:>6} {3:>6}".format(name.ljust(10), tasks - done, done, urgent))
+    return(0)
+
+CLI_COMMANDS = {
+    "add": cli_add,
+    "list": cli_list,
+    "done": cli_set_flag,
+    "urgent": cli_set_flag,
+    "export": cli_export,
+    "import": cli_import,
+    "changes": cli_changes,
+    "apply": cli_apply,
+    "find": cli_find,
+    "counts": cli_counts,
+}
+
+
+if __name__ == '__main__':
+    raise SystemExit(cli_main(argv[1:]))